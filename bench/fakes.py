@@ -0,0 +1,209 @@
+from typing import Any, Dict, List, Optional
+from collections import Counter
+import importlib.util
+import datetime
+import asyncio
+import random
+import json
+import sys
+import os
+
+# In-process stand-ins for the parts of discord.py EqualBot touches, so it can be driven without a gateway. Every
+# coroutine that would be a REST call goes through FakeAPI, which counts it by route and sleeps for the configured latency
+
+_src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, _src_path)
+
+import discord
+
+def load_bot_module():
+	spec = importlib.util.spec_from_file_location("equalbot", os.path.join(_src_path, "__main__.py"))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+class FakeAPI:
+
+	def __init__(self, latency: float = 0, jitter: float = 0):
+		self.latency = latency
+		self.jitter = jitter
+		self.calls = Counter()
+
+	async def call(self, route: str):
+		self.calls[route] += 1
+		delay = self.latency + (random.random() * self.jitter if self.jitter else 0)
+
+		if delay > 0:
+			await asyncio.sleep(delay)
+		else:
+			await asyncio.sleep(0) # Still yield so handlers interleave the way they would on a real connection
+
+class FakeUser:
+
+	def __init__(self, id: int, name: str, bot: bool = False):
+		self.id = id
+		self.name = name
+		self.bot = bot
+		self.mention = f"<@{id}>"
+
+class FakeMessage:
+
+	def __init__(self, api: FakeAPI, id: int, author: FakeUser, content: str, channel: Optional["FakeChannel"] = None,
+			reference: Any = None, attachments: List[Any] = None, reactions: List[Any] = None, stickers: List[Any] = None, embeds: List[Any] = None):
+		self.api = api
+		self.id = id
+		self.author = author
+		self.content = content
+		self.clean_content = content
+		self.channel = channel
+		self.guild = channel.guild if channel is not None else None
+		self.reference = reference
+		self.attachments = attachments or []
+		self.reactions = reactions or []
+		self.stickers = stickers or []
+		self.embeds = embeds or []
+		self.created_at = discord.utils.snowflake_time(id)
+		self.jump_url = f"https://discord.com/channels/{self.guild.id if self.guild else '@me'}/{channel.id if channel else 0}/{id}"
+		self.replies: List[dict] = []
+
+	def is_system(self) -> bool:
+		return False
+
+	async def reply(self, content: str = None, **kwargs):
+		await self.api.call("POST /channels/{channel_id}/messages")
+		self.replies.append({"content": content, **kwargs})
+
+	async def delete(self):
+		await self.api.call("DELETE /channels/{channel_id}/messages/{message_id}")
+
+		if self.channel is not None:
+			self.channel.messages.pop(self.id, None)
+
+	async def clear_reactions(self):
+		await self.api.call("DELETE /channels/{channel_id}/messages/{message_id}/reactions")
+		self.reactions = []
+
+	async def edit(self, content: str = None, **kwargs):
+		await self.api.call("PATCH /channels/{channel_id}/messages/{message_id}")
+		self.content = self.clean_content = content
+
+class FakePartialMessage:
+
+	def __init__(self, channel: "FakeChannel", id: int):
+		self.channel = channel
+		self.id = id
+
+	def _resolve(self) -> FakeMessage:
+		message = self.channel.messages.get(self.id)
+
+		if message is None:
+			raise discord.NotFound(type("Response", (), {"status": 404, "reason": "Not Found"})(), "Unknown Message")
+
+		return message
+
+	async def edit(self, content: str = None, **kwargs):
+		await self._resolve().edit(content = content, **kwargs)
+
+	async def delete(self):
+		await self._resolve().delete()
+
+class FakeGuild:
+
+	def __init__(self, id: int):
+		self.id = id
+		self.roles: List[Any] = []
+
+class FakeChannel:
+
+	def __init__(self, api: FakeAPI, id: int, guild: Optional[FakeGuild], bot_user: FakeUser):
+		self.api = api
+		self.id = id
+		self.guild = guild
+		self.bot_user = bot_user
+		self.messages: Dict[int, FakeMessage] = {}
+		self._next_id = id
+
+	def next_id(self, when: Optional[datetime.datetime] = None) -> int:
+		snowflake = discord.utils.time_snowflake(when or datetime.datetime.now(datetime.timezone.utc)) + random.randrange(1 << 12)
+		self._next_id = max(self._next_id + 1, snowflake)
+		return self._next_id
+
+	def add(self, author: FakeUser, content: str, when: Optional[datetime.datetime] = None, **kwargs) -> FakeMessage:
+		message = FakeMessage(self.api, self.next_id(when), author, content, self, **kwargs)
+		self.messages[message.id] = message
+		return message
+
+	async def history(self, limit: Optional[int] = None, before: Any = None, after: Any = None, oldest_first: Optional[bool] = None):
+		if oldest_first is None:
+			oldest_first = after is not None
+
+		ids = sorted(message_id for message_id in self.messages
+			if (after is None or message_id > after.id) and (before is None or message_id < before.id))
+
+		if not oldest_first:
+			ids.reverse()
+
+		if limit is not None:
+			ids = ids[:limit]
+
+		for page in range(0, ids.__len__(), 100): # Discord pages history 100 messages at a time
+			await self.api.call("GET /channels/{channel_id}/messages")
+
+			for message_id in ids[page:page + 100]:
+				if message_id in self.messages:
+					yield self.messages[message_id]
+
+	async def send(self, content: str = None, **kwargs) -> FakeMessage:
+		await self.api.call("POST /channels/{channel_id}/messages")
+		return self.add(self.bot_user, content)
+
+	def get_partial_message(self, message_id: int) -> FakePartialMessage:
+		return FakePartialMessage(self, message_id)
+
+	async def delete_messages(self, messages: List[Any]):
+		await self.api.call("POST /channels/{channel_id}/messages/bulk-delete")
+
+		for message in messages:
+			self.messages.pop(message.id, None)
+
+def write_config(root: str, **config):
+	os.makedirs(os.path.join(root, "config"), exist_ok = True)
+	os.makedirs(os.path.join(root, "data"), exist_ok = True)
+
+	with open(os.path.join(root, "config", "bot.json"), "w") as config_file:
+		json.dump(config, config_file)
+
+	birthdays_path = os.path.join(root, "data", "birthdays.json")
+	if not os.path.isfile(birthdays_path):
+		with open(birthdays_path, "w") as birthdays_file:
+			json.dump({}, birthdays_file)
+
+class FakeWorld:
+
+	def __init__(self, root: str, latency: float = 0, jitter: float = 0, **config):
+		self.api = FakeAPI(latency, jitter)
+		self.bot_user = FakeUser(1, "EqualBot", True)
+		self.guild = FakeGuild(10)
+
+		self.equal_channel = FakeChannel(self.api, 100, self.guild, self.bot_user)
+		self.leaderboard_channel = FakeChannel(self.api, 200, self.guild, self.bot_user)
+		self.chaos_channel = FakeChannel(self.api, 300, self.guild, self.bot_user)
+		self.channels = {channel.id: channel for channel in (self.equal_channel, self.leaderboard_channel, self.chaos_channel)}
+
+		write_config(root, **{
+			"Equal Channel ID": self.equal_channel.id,
+			"Leaderboard Channel ID": self.leaderboard_channel.id,
+			"Chaos Channel ID": self.chaos_channel.id,
+			**config
+		})
+
+		self.bot = load_bot_module().EqualBot(root)
+		self.bot._connection.user = self.bot_user
+		self.bot.get_channel = self.channels.get
+
+	@property
+	def tenant(self) -> Any: # The one guild the world is configured with
+		return next(iter(self.bot.configured_tenants.values()))
+
+	def dm(self, author: FakeUser, content: str) -> FakeMessage:
+		return FakeMessage(self.api, self.equal_channel.next_id(), author, content)
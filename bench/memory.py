@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Measures EqualBot's resident memory against guild member count, with the default caches and with "Low Memory Mode".
+# Each run is a fresh process that builds the bot, hands discord.py's connection state a guild with that many members
+# (what chunking would leave cached) and a stream of messages, then reads its RSS. Run python3 ./bench/memory.py --help
+
+from fakes import write_config, load_bot_module
+import subprocess
+import argparse
+import tempfile
+import json
+import sys
+import gc
+
+def _resident_kib() -> int: # -1 where /proc isn't available
+	try:
+		with open("/proc/self/status", "r") as status_file:
+			for line in status_file:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1])
+	except OSError:
+		pass
+
+	return -1
+
+def _member(index: int) -> dict:
+	return {
+		"user": {"id": str(1000 + index), "username": f"user{index}", "discriminator": "0", "global_name": None, "avatar": None},
+		"roles": [], "joined_at": "2020-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0
+	}
+
+def _message(index: int, channel_id: int, guild_id: int, members: int) -> dict:
+	return {
+		"id": str(channel_id + 1 + index), "channel_id": str(channel_id), "guild_id": str(guild_id),
+		"author": _member(index % max(1, members))["user"], "member": {"roles": [], "joined_at": "2020-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0},
+		"content": "Equal", "timestamp": "2020-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False, "mention_everyone": False,
+		"mentions": [], "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0
+	}
+
+def measure(members: int, messages: int, low_memory: bool) -> dict:
+	guild_id, equal_channel_id = 10, 100
+
+	with tempfile.TemporaryDirectory() as root:
+		write_config(root, **{"Equal Channel ID": equal_channel_id, "Low Memory Mode": low_memory})
+
+		bot = load_bot_module().EqualBot(root)
+		state = bot._connection
+		state.dispatch = lambda *args, **kwargs: None # Only the caches are being measured, not the handlers
+
+		gc.collect()
+		before = _resident_kib()
+
+		guild_data = {
+			"id": str(guild_id), "name": "Equal", "member_count": members, "large": members > 250,
+			"roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+			"channels": [{"id": str(equal_channel_id), "type": 0, "name": "equal", "position": 0, "permission_overwrites": []}],
+			"members": [_member(index) for index in range(members)]
+		}
+		guild = state._add_guild_from_data(guild_data)
+		del guild_data
+
+		for index in range(messages):
+			state.parse_message_create(_message(index, equal_channel_id, guild_id, members))
+
+		gc.collect()
+		after = _resident_kib()
+
+		return {"members": members, "cached_members": guild._members.__len__(), "cached_messages": (state._messages or ()).__len__(), "before": before, "after": after}
+
+def main():
+	parser = argparse.ArgumentParser(description = "Measure EqualBot's resident memory against guild member count")
+	parser.add_argument("--members", type = int, nargs = "+", default = [0, 1000, 10000, 50000, 100000])
+	parser.add_argument("--messages", type = int, default = 5000, help = "messages seen in the Equal channel")
+	parser.add_argument("--child", action = "store_true", help = argparse.SUPPRESS)
+	parser.add_argument("--low-memory", action = "store_true", help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		print(json.dumps(measure(args.members[0], args.messages, args.low_memory)))
+		return
+
+	print(f"{'members':>10} {'mode':>10} {'cached members':>15} {'cached messages':>16} {'RSS MiB':>9} {'growth MiB':>11}")
+
+	for members in args.members:
+		for low_memory in (False, True):
+			command = [sys.executable, __file__, "--child", "--members", str(members), "--messages", str(args.messages)] + (["--low-memory"] if low_memory else [])
+			result = json.loads(subprocess.run(command, check = True, capture_output = True, text = True).stdout.splitlines()[-1])
+
+			print(f"{members:>10} {'low' if low_memory else 'default':>10} {result['cached_members']:>15} {result['cached_messages']:>16} "
+				f"{result['after'] / 1024:>9.1f} {(result['after'] - result['before']) / 1024:>11.1f}")
+
+if __name__ == "__main__":
+	main()
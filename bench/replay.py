@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# Replays a synthetic workload against EqualBot with fake Discord objects and prints throughput, handler latency, bytes
+# written to disk and API calls made. Run python3 ./bench/replay.py --help for the knobs
+
+from fakes import FakeWorld, FakeUser, FakeMessage
+from typing import Dict, List
+import contextlib
+import argparse
+import datetime
+import tempfile
+import asyncio
+import random
+import time
+import io
+
+def _written_bytes() -> int: # Bytes handed to write() by this process, -1 where /proc isn't available
+	try:
+		with open("/proc/self/io", "r") as io_file:
+			for line in io_file:
+				if line.startswith("wchar:"):
+					return int(line.split()[1])
+	except OSError:
+		pass
+
+	return -1
+
+def _percentile(samples: List[float], percent: float) -> float:
+	if not samples.__len__():
+		return 0.0
+
+	ordered = sorted(samples)
+	return ordered[min(ordered.__len__() - 1, int(ordered.__len__() * percent / 100))]
+
+class Phase:
+
+	def __init__(self, name: str, world: FakeWorld):
+		self.name = name
+		self.world = world
+		self.latencies: List[float] = []
+
+	def __enter__(self):
+		self.calls = self.world.api.calls.copy()
+		self.written = _written_bytes()
+		self.started = time.perf_counter()
+		return self
+
+	def __exit__(self, *_):
+		self.elapsed = time.perf_counter() - self.started
+		written = _written_bytes()
+		self.written = written - self.written if written >= 0 else -1
+		self.calls = self.world.api.calls - self.calls
+
+	def report(self, events: int):
+		print(f"{self.name}")
+		print(f"\t{events} event{'' if events == 1 else 's'} in {self.elapsed:.3f}s, {events / self.elapsed if self.elapsed else 0:.1f}/s")
+
+		if self.latencies.__len__():
+			print(f"\tlatency p50 {_percentile(self.latencies, 50) * 1000:.3f}ms, p99 {_percentile(self.latencies, 99) * 1000:.3f}ms, max {max(self.latencies) * 1000:.3f}ms")
+
+		print(f"\tdisk written {'n/a' if self.written < 0 else f'{self.written} bytes'}")
+		print(f"\tAPI calls {sum(self.calls.values())}")
+
+		for route, count in sorted(self.calls.items()):
+			print(f"\t\t{count:>8} {route}")
+
+def _workload(world: FakeWorld, authors: List[FakeUser], count: int, mix: Dict[str, float]) -> List[FakeMessage]:
+	kinds, weights = zip(*mix.items())
+	messages = []
+
+	for kind in random.choices(kinds, weights, k = count):
+		author = random.choice(authors)
+
+		if kind == "valid":
+			messages.append((world.equal_channel.add(author, "Equal"), False))
+
+		elif kind == "invalid":
+			messages.append((world.equal_channel.add(author, random.choice(("equal", "Equal!", "not Equal", "Equal 🎄"))), False))
+
+		elif kind == "edited":
+			original = world.equal_channel.add(author, "Equal")
+			messages.append((original, False))
+			messages.append((FakeMessage(world.api, original.id, author, "Equal?", world.equal_channel), True))
+
+		elif kind == "bday":
+			messages.append((world.dm(author, f"bday {random.randint(1, 12)} {random.randint(1, 28)}"), False))
+
+		else:
+			messages.append((world.dm(author, random.choice(("chaos balance", "chaos post something chaotic", "chaos confirm", "chaos cancel"))), False))
+
+	return messages
+
+async def replay(args: argparse.Namespace):
+	random.seed(args.seed)
+
+	with tempfile.TemporaryDirectory() as root:
+		world = FakeWorld(root, args.latency, args.jitter, **{
+			"Leaderboard Update Window (in seconds)": args.leaderboard_window,
+			"Outbound Bucket Interval (in seconds)": 0,
+			"Storage Backend": args.storage
+		})
+		bot = world.bot
+		tenant = world.tenant
+		authors = [FakeUser(1000 + index, f"user{index}") for index in range(args.users)]
+
+		# Historical search over a pre-filled channel
+		start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days = 30)
+		for index in range(args.history):
+			world.equal_channel.add(random.choice(authors), "Equal" if random.random() < 0.9 else "nope", start + datetime.timedelta(seconds = index))
+
+		with contextlib.redirect_stdout(io.StringIO()), Phase("historical search", world) as phase: # Keep progress prints out of the byte counts
+			await tenant.historical_search(True)
+		phase.report(args.history)
+
+		with Phase("leaderboard publish", world) as phase:
+			await tenant.leaderboard.publish()
+		phase.report(1)
+
+		# Live traffic at the requested rate
+		tenant.start()
+		messages = _workload(world, authors, args.messages, {"valid": args.valid, "invalid": args.invalid, "edited": args.edited, "bday": args.bday, "chaos": args.chaos})
+
+		async def handle(message: FakeMessage, edited: bool, due: float, latencies: List[float]):
+			delay = due - time.perf_counter()
+			if delay > 0:
+				await asyncio.sleep(delay)
+
+			began = time.perf_counter()
+			await bot.message_handle(message, edited)
+			latencies.append(time.perf_counter() - began)
+
+		with contextlib.redirect_stdout(io.StringIO()), Phase("live messages", world) as phase:
+			began = time.perf_counter()
+			interval = 1 / args.rate if args.rate > 0 else 0
+			await asyncio.gather(*(handle(message, edited, began + index * interval, phase.latencies) for index, (message, edited) in enumerate(messages)))
+			await tenant.leaderboard.close()
+			await bot.outbound.close()
+			await tenant.close()
+		phase.report(messages.__len__())
+
+		with Phase("check_message", world) as phase:
+			for message, _ in messages[:args.checks]:
+				if message.guild is not None:
+					began = time.perf_counter()
+					tenant.check_message(message)
+					phase.latencies.append(time.perf_counter() - began)
+		phase.report(phase.latencies.__len__())
+
+def main():
+	parser = argparse.ArgumentParser(description = "Replay a synthetic workload against EqualBot offline")
+	parser.add_argument("--users", type = int, default = 200)
+	parser.add_argument("--messages", type = int, default = 5000, help = "live messages to replay")
+	parser.add_argument("--rate", type = float, default = 0, help = "messages per second, 0 fires them all at once")
+	parser.add_argument("--history", type = int, default = 20000, help = "messages already in the equal channel")
+	parser.add_argument("--latency", type = float, default = 0.0, help = "seconds per fake API call")
+	parser.add_argument("--jitter", type = float, default = 0.0, help = "extra random seconds per fake API call")
+	parser.add_argument("--leaderboard-window", type = float, default = 1.0)
+	parser.add_argument("--checks", type = int, default = 5000, help = "messages to time check_message on")
+	parser.add_argument("--valid", type = float, default = 0.7)
+	parser.add_argument("--invalid", type = float, default = 0.1)
+	parser.add_argument("--edited", type = float, default = 0.05)
+	parser.add_argument("--bday", type = float, default = 0.05)
+	parser.add_argument("--chaos", type = float, default = 0.1)
+	parser.add_argument("--storage", choices = ("json", "sqlite"), default = "json")
+	parser.add_argument("--seed", type = int, default = 0)
+
+	asyncio.run(replay(parser.parse_args()))
+
+if __name__ == "__main__":
+	main()
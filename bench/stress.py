@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Fires interleaved events for many users at once and checks the final balances against what applying each user's events
+# in order would give. Run it with python3 ./bench/stress.py [users] [rounds]
+
+from fakes import FakeWorld, FakeUser, FakeMessage
+import tempfile
+import asyncio
+import random
+import sys
+
+async def stress(users: int, rounds: int, seed: int = 0) -> bool:
+	random.seed(seed)
+
+	with tempfile.TemporaryDirectory() as root:
+		world = FakeWorld(root, latency = 0.001, jitter = 0.004, **{"Leaderboard Update Window (in seconds)": 0.05})
+		bot = world.bot
+		authors = [FakeUser(1000 + index, f"user{index}") for index in range(users)]
+		expected = {author.id: {"points": 0, "posts": 0} for author in authors}
+
+		events = []
+
+		for _ in range(rounds):
+			author = random.choice(authors)
+			model = expected[author.id]
+			roll = random.random()
+
+			if roll < 0.75: # Equal
+				events.append(bot.message_handle(world.equal_channel.add(author, "Equal")))
+				model["points"] += 1
+
+			elif roll < 0.85: # Equal edited into something else, the delete and the debit race the original message
+				message = world.equal_channel.add(author, "Equal")
+				events.append(bot.message_handle(message))
+				model["points"] += 1
+
+				edited = FakeMessage(world.api, message.id, author, "not equal", world.equal_channel)
+				events.append(bot.message_handle(edited, True))
+				model["points"] -= 1
+
+			elif model["points"] - model["posts"] * 50 >= 50: # Post then double confirm, only one may be charged
+				events.append(bot.message_handle(world.dm(author, "chaos post hello")))
+				events.append(bot.message_handle(world.dm(author, "chaos confirm")))
+				events.append(bot.message_handle(world.dm(author, "chaos confirm")))
+				model["posts"] += 1
+
+			else:
+				events.append(bot.message_handle(world.dm(author, "chaos balance")))
+
+		await asyncio.gather(*events) # Each handler queues on its user's lock before its first await, in this order
+		await world.tenant.leaderboard.close()
+
+		failures = 0
+
+		for author in authors:
+			model = expected[author.id]
+			balance = world.tenant.get_balance(author.id)
+			posts = world.tenant.ledger.users.get(str(author.id), {"posts": 0})["posts"]
+
+			if balance != model["points"] - model["posts"] * 50 or posts != model["posts"]:
+				failures += 1
+				print(f"{author.name}: balance {balance} with {posts} posts, expected {model['points'] - model['posts'] * 50} with {model['posts']}")
+
+		print(f"{events.__len__()} events across {users} users, {world.chaos_channel.messages.__len__()} chaos posts, {failures} mismatched user{'' if failures == 1 else 's'}")
+		return not failures
+
+if __name__ == "__main__":
+	sys.exit(0 if asyncio.run(stress(int(sys.argv[1]) if sys.argv.__len__() > 1 else 20, int(sys.argv[2]) if sys.argv.__len__() > 2 else 5000)) else 1)
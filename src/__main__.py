@@ -1,405 +1,459 @@
 #!/usr/bin/env python3
 
-from typing import Union, Dict
-from pathlib import Path
-import datetime
+from typing import Dict, List, Optional, Tuple
+from util import _read_json, _write_json, _write_json_atomic, _project_root
+from tenant import GuildTenant
+from rules import MessageRules, DEFAULT_RULES
+from outbound import OutboundScheduler
+from metrics import metrics
+import asyncio
 import discord
 import dotenv
 import time
-import json
 import os
 
-# Next version needs to implement thread safety
-
-def _read_json(path: str) -> dict:
-	with open(path, "r") as json_file:
-		return json.load(json_file)
-
-def _write_json(path: str, data: dict, neat: bool = False):
-	with open(path, "w") as json_file:
-		if neat:
-			json.dump(data, json_file, indent = 4)
-		else:
-			json.dump(data, json_file)
-
-_project_root = Path(os.path.abspath(__file__)).parent.parent.__str__()
 _months = (
 	"jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec",
 	"january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december",
 	"1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"
 )
 
-class EqualBot(discord.Client):
+class EqualBot(discord.AutoShardedClient):
 
-	def __init__(self):
-		super().__init__(intents = discord.Intents(messages = True, members = True, guilds = True))
+	def __init__(self, project_root: str = _project_root):
+		config_path = os.path.join(project_root, "config", "bot.json")
+		bot_config = _read_json(config_path)
 
-		self.chaos_file_path = os.path.join(_project_root, "data", "chaos.json")
+		intents = discord.Intents(messages = True, members = True, guilds = True)
+		low_memory = bot_config.get("Low Memory Mode", False) # Only keep what the Equal and leaderboard channels and joins need
+		message_cache_size = bot_config.get("Message Cache Size", None) # 0 turns it off, edits to uncached messages come through on_raw_message_edit
 
-		bot_config = _read_json(os.path.join(_project_root, "config", "bot.json"))
+		if message_cache_size is None:
+			message_cache_size = 0 if low_memory else 1000
+
+		super().__init__(intents = intents, shard_count = bot_config.get("Shard Count", None), # None lets Discord recommend how many
+			chunk_guilds_at_startup = not low_memory,
+			member_cache_flags = discord.MemberCacheFlags.none() if low_memory else discord.MemberCacheFlags.from_intents(intents), # on_member_join is handed the member either way
+			max_messages = message_cache_size or None)
+
+		self.data_path = os.path.join(project_root, "data")
+		self.last_online_file_path = os.path.join(self.data_path, "last_online.json")
+		self.config_path = config_path
+		self.members_cached = not low_memory # Otherwise DM commands have to ask Discord which guilds someone is in
 
 		self.historical_search_threshold = bot_config.get("Historical Search Threshold (in seconds)", 30)
-		self.leaderboard_channel_id = bot_config.get("Leaderboard Channel ID", None)
-		self.equal_channel_id = bot_config.get("Equal Channel ID", None)
-		self.equal_role_id = bot_config.get("Equal Role ID", None)
-		self.chaos_channel_id = bot_config.get("Chaos Channel ID", None)
-		self.historical_purge = bot_config.get("Historical Purge", False)
+		self.heartbeat_interval = bot_config.get("Heartbeat Interval (in seconds)", 60)
 
-		self.posts_to_confirm: Dict[int, str] = {}
+		self.metrics_enabled = bot_config.get("Metrics Enabled", False)
+		self.metrics_host = bot_config.get("Metrics Host", "127.0.0.1")
+		self.metrics_port = bot_config.get("Metrics Port", 9108)
+		self.admin_user_ids = bot_config.get("Admin User IDs", []) # Allowed to DM the metrics and rules commands
 
-		birthday_data = _read_json(os.path.join(_project_root, "data", "birthdays.json"))
+		self.outbound = OutboundScheduler(bot_config.get("Outbound Bucket Interval (in seconds)", 0.25), bot_config.get("Outbound Concurrency", 4))
 
-		self.birthday_cache = [ # 2d matrix making a calendar
-			[0] * 31, [0] * 29, [0] * 31, [0] * 30,
-			[0] * 31, [0] * 30, [0] * 31, [0] * 31,
-			[0] * 30, [0] * 31, [0] * 30, [0] * 31
-		]
+		self.configured_tenants: Dict[Optional[str], GuildTenant] = {} # By their key under "Guilds", None for a config without one
+		self.tenants: Dict[int, GuildTenant] = {} # By guild id, once it's known
+		self.chosen_tenants: Dict[int, GuildTenant] = {} # Which guild each user's DM commands are for, when they're in more than one
 
-		for birthday in birthday_data.values():
-			if not isinstance(birthday, dict):
-				raise ValueError("Invalid birthday entry, must be a dictionary")
+		for key, guild_config, data_path in self.guild_configs(bot_config):
+			self.configured_tenants[key] = GuildTenant(self, None if key is None else int(key), guild_config, data_path, self.outbound)
 
-			try:
-				month = int(birthday.get("month", 13))
-			except ValueError:
-				raise ValueError(f"Invalid month, must be a number, not \"{birthday.get('month')}\"")
+		if self.metrics_enabled:
+			self.enable_metrics()
 
-			try:
-				day = int(birthday.get("day", 32))
-			except ValueError:
-				raise ValueError(f"Invalid day, must be a number, not \"{birthday.get('day')}\"")
+		self.last_online = self.read_last_online() # How the previous run ended, read before the heartbeat overwrites it
+		self.heartbeat_task: Optional[asyncio.Task] = None
 
-			if month < 1 or month > 12:
-				raise ValueError(f"Invalid month \"{month}\", must be 1 <= month <= 12")
+	def guild_configs(self, bot_config: dict) -> List[Tuple[Optional[str], dict, str]]: # (key, settings, data path) per guild
+		guilds = bot_config.get("Guilds", None) # {guild id: settings overriding the top level ones}
 
-			if day < 1 or day > self.birthday_cache[month - 1].__len__():
-				raise ValueError(f"Invalid day \"{day}\", must be 1 <= day <= {self.birthday_cache[month - 1].__len__()}")
+		if guilds is None: # Single guild, its data stays directly in data/
+			return [(None, bot_config, self.data_path)]
 
-			self.birthday_cache[month - 1][day - 1] += 1
+		shared = {key: value for key, value in bot_config.items() if key != "Guilds"}
 
-	async def increase_chaos(self, user_id: Union[int, str], user_name: str):
-		user_id = str(user_id)
-		chaos_data = _read_json(self.chaos_file_path)
+		return [(guild_id, {**shared, **overrides}, os.path.join(self.data_path, "guilds", guild_id)) for guild_id, overrides in guilds.items()]
 
-		if user_id not in chaos_data:
-			chaos_data[user_id] = {"name": user_name, "points": 0, "chaos_posts": []}
+	def reload_rules(self): # Compiled for every guild before any are swapped in, a bad config leaves all the current rules in place
+		guild_configs = {key: guild_config for key, guild_config, _ in self.guild_configs(_read_json(self.config_path))}
+		rules = {key: MessageRules.compile(guild_configs[key].get("Message Rules", DEFAULT_RULES)) for key in self.configured_tenants if key in guild_configs}
 
-		chaos_data[user_id]["points"] += 1
-		_write_json(self.chaos_file_path, chaos_data)
-		await self.update_leaderboard()
+		for key, compiled in rules.items():
+			self.configured_tenants[key].rules = compiled
 
-	async def decrease_chaos(self, user_id: Union[int, str], user_name: str):
-		user_id = str(user_id)
-		chaos_data = _read_json(self.chaos_file_path)
+	def resolve_tenants(self):
+		for tenant in self.configured_tenants.values():
+			if tenant.resolve():
+				self.tenants[tenant.guild_id] = tenant
 
-		if user_id not in chaos_data:
-			chaos_data[user_id] = {"name": user_name, "points": 0, "chaos_posts": []}
+	def tenant_for(self, guild_id: int) -> Optional[GuildTenant]:
+		tenant = self.tenants.get(guild_id)
 
-		chaos_data[user_id]["points"] -= 1
+		if tenant is None and self.tenants.__len__() < self.configured_tenants.__len__(): # Some guild ids still aren't known
+			self.resolve_tenants()
+			tenant = self.tenants.get(guild_id)
 
-		if chaos_data[user_id]["points"] < 0: # Prevent negative
-			chaos_data[user_id]["points"] = 0
+		return tenant
 
-		_write_json(self.chaos_file_path, chaos_data)
-		await self.update_leaderboard()
+	def guild_name(self, tenant: GuildTenant) -> str:
+		guild = self.get_guild(tenant.guild_id) if tenant.guild_id is not None else None
+		return f"{tenant.guild_id}" if guild is None else f"{guild.name} ({tenant.guild_id})"
 
-	async def generate_leaderboard_messaage(self) -> str:
-		chaos_data = _read_json(self.chaos_file_path)
+	async def command_tenant(self, message: discord.Message) -> Optional[GuildTenant]: # Which guild a DM command is about
+		if self.configured_tenants.__len__() == 1:
+			return next(iter(self.configured_tenants.values()))
 
-		longest_username_length = max(chaos_data.values(), key = lambda x: x["name"].__len__())["name"].__len__()
-		longest_chaos_points = max(chaos_data.values(), key = lambda x: (x["points"] - x["chaos_posts"].__len__() * 50).__str__().__len__())
-		longest_chaos_points = (longest_chaos_points["points"] - longest_chaos_points["chaos_posts"].__len__() * 50).__str__().__len__()
-		longest_chaos_posts = max(chaos_data.values(), key = lambda x: x["chaos_posts"].__len__().__str__().__len__())["chaos_posts"].__len__().__str__().__len__()
+		if message.author.id in self.chosen_tenants:
+			return self.chosen_tenants[message.author.id]
 
-		output = ""
+		member_of = []
 
-		for user_data in sorted(chaos_data.values(), key = lambda x: x["points"], reverse = True):
-			output += f"\n[ {user_data['name']:<{longest_username_length}} ][ {(user_data['points'] - user_data['chaos_posts'].__len__() * 50):^{longest_chaos_points}} ][ {user_data['chaos_posts'].__len__():>{longest_chaos_posts}} ]"
+		for tenant in self.tenants.values():
+			guild = self.get_guild(tenant.guild_id)
 
-		return f"```md{output}\n```"
+			if guild is None:
+				continue
 
-	async def update_leaderboard(self):
-		leaderboard: discord.TextChannel = self.get_channel(self.leaderboard_channel_id)
+			member = guild.get_member(message.author.id)
 
-		if leaderboard is None:
-			print(f"Unable to update leaderboard, couldn't find channel with id \"{self.leaderboard_channel_id}\"")
-			return
+			if member is None and not self.members_cached:
+				try:
+					member = await guild.fetch_member(message.author.id)
+				except discord.NotFound:
+					pass
+				except discord.HTTPException as error:
+					print(f"Unable to look up {message.author.id} in guild {tenant.guild_id}: {error}")
 
-		async for message in leaderboard.history(oldest_first = True, limit = None):
-			if message.author.id == self.user.id:
-				await message.edit(content = await self.generate_leaderboard_messaage())
-				return
+			if member is not None:
+				member_of.append(tenant)
 
-		await leaderboard.send(content = await self.generate_leaderboard_messaage())
+		if member_of.__len__() == 1 and not self.members_cached: # Fetched, don't ask Discord again next time
+			self.chosen_tenants[message.author.id] = member_of[0]
 
-	def update_last_online(self):
-		_write_json(os.path.join(_project_root, "data", "last_online.json"), int(time.time()))
+		if member_of.__len__() == 1:
+			return member_of[0]
 
-	async def on_ready(self):
-		print(f"Readying as {self.user} ({self.user.id})")
+		await message.reply(embed = discord.Embed(title = "guild Command", description = "Pick a server first", color = discord.Color.dark_blue())\
+			.add_field(name = "Use `guild` **<**`server id`**>**", value = "\n".join(self.guild_name(tenant) for tenant in (member_of or self.tenants.values())) or "No servers yet"), mention_author=False)
 
-		print(f"Use this link to join your bot to your server: https://discord.com/api/oauth2/authorize?client_id={self.user.id}&permissions=8&scope=bot")
+	def enable_metrics(self):
+		metrics.enable()
+		metrics.gauge("outbound_queued", self.outbound.pending)
+		metrics.gauge("guilds", lambda: self.tenants.__len__())
+		metrics.gauge("chaos_users", lambda: sum(tenant.ledger.users.__len__() for tenant in self.configured_tenants.values()))
+		metrics.gauge("chaos_journal_pending", lambda: sum(tenant.ledger.pending.__len__() for tenant in self.configured_tenants.values()))
 
-		await self.change_presence(activity = discord.Game("God"))
+		request = self.http.request
 
-		last_online_path = os.path.join(_project_root, "data", "last_online.json")
+		async def counted_request(route: discord.http.Route, **kwargs):
+			metrics.inc("discord_api_calls_total", route = f"{route.method} {route.path}")
+			return await request(route, **kwargs)
 
-		should_run_historical_search = False
+		self.http.request = counted_request
 
-		if os.path.isfile(last_online_path):
-			last_online = _read_json(last_online_path)
+	def read_last_online(self) -> Optional[dict]:
+		if not os.path.isfile(self.last_online_file_path):
+			return None
 
-			delta = int((datetime.datetime.now() - datetime.datetime.fromtimestamp(last_online)).total_seconds())
+		try:
+			last_online = _read_json(self.last_online_file_path)
+		except ValueError: # Torn write, treat it like a crash
+			return {"heartbeat": 0, "clean_shutdown": False}
 
-			if delta >= self.historical_search_threshold:
-				print("\tLast online ", delta, " second", "" if delta == 1 else "s", " ago which is greater than or equal to ", self.historical_search_threshold, " second", "" if self.historical_search_threshold == 1 else "s", sep="")
-				should_run_historical_search = True
-		else:
-			should_run_historical_search = True
+		if isinstance(last_online, int): # Older versions stored a bare timestamp per message, no way to tell how it stopped
+			return {"heartbeat": last_online, "clean_shutdown": False}
 
-		self.update_last_online()
+		return last_online
 
-		if should_run_historical_search or not os.path.isfile(self.chaos_file_path): # Trigger chaos points historical search
-			print("\tRunning historical search to calculate chaos points")
-			chaos_data = {}
+	def update_last_online(self, clean_shutdown: bool = False):
+		_write_json_atomic(self.last_online_file_path, {"heartbeat": int(time.time()), "clean_shutdown": clean_shutdown})
 
-			equal_channel: discord.TextChannel = self.get_channel(self.equal_channel_id)
+	async def heartbeat(self):
+		while True:
+			await asyncio.sleep(self.heartbeat_interval)
 
-			if equal_channel is not None:
-				message: discord.Message
-				async for message in equal_channel.history(limit = None):
-					author_id = str(message.author.id)
-					if author_id not in chaos_data:
-						chaos_data[author_id] = {"name": message.author.name, "points": 0, "chaos_posts": []}
+			try:
+				self.update_last_online()
+			except OSError as error:
+				print(f"Unable to write heartbeat to \"{self.last_online_file_path}\": {error}")
 
-					check = await self.check_message(message)
-					if check == 1:
-						chaos_data[author_id]["points"] += 1
+	async def on_ready(self):
+		print(f"Readying as {self.user} ({self.user.id}) on {self.shard_count} shard{'' if self.shard_count == 1 else 's'}")
 
-					elif check == -1:
-						if self.historical_purge:
-							print("\t\tPurging message by ", message.author.name, " (", message.author.id, ") saying ", message.clean_content, sep = "")
-							await message.delete()
-						else:
-							print("\t\tNot purging bad message at", message.jump_url)
+		print(f"Use this link to join your bot to your server: https://discord.com/api/oauth2/authorize?client_id={self.user.id}&permissions=8&scope=bot")
 
-						chaos_data[author_id]["points"] -= 1
+		for tenant in self.configured_tenants.values():
+			tenant.start()
 
-				print("\tSaving new chaos data")
-				_write_json(self.chaos_file_path, chaos_data)
+		await self.change_presence(activity = discord.Game("God"))
 
-		await self.update_leaderboard()
+		self.resolve_tenants()
 
-		print("Readied")
+		if self.metrics_enabled:
+			try:
+				await metrics.serve(self.metrics_host, self.metrics_port)
+			except OSError as error:
+				print(f"\tUnable to serve metrics on {self.metrics_host}:{self.metrics_port}: {error}")
 
-	async def check_message(self, message: discord.Message) -> int:
-		if message.author.id == self.user.id: # Don't listen to myself by mistake
-			return 0
+		should_run_historical_search = False
+		reconnected = self.heartbeat_task is not None
 
-		if message.channel is not None:
-			if message.channel.id != self.equal_channel_id: # Equal text channel
-				return 0
+		if not reconnected: # First ready since starting
+			last_online = self.last_online
 
-			if message.reference is not None and not message.is_system(): # Prevent replies
-				return -1
+			if last_online is None:
+				should_run_historical_search = True
 
-			if message.attachments.__len__(): # Don't allow attachments
-				return -1
+			else:
+				delta = int(time.time()) - last_online["heartbeat"]
 
-			if message.reactions.__len__(): # Don't allow reactions
-				await message.clear_reactions() # Auto fix
+				if not last_online.get("clean_shutdown"):
+					print("\tDidn't shut down cleanly, last heartbeat was ", delta, " second", "" if delta == 1 else "s", " ago", sep="")
+					should_run_historical_search = True
 
-			content = message.clean_content
+				elif delta >= self.historical_search_threshold:
+					print("\tLast online ", delta, " second", "" if delta == 1 else "s", " ago which is greater than or equal to ", self.historical_search_threshold, " second", "" if self.historical_search_threshold == 1 else "s", sep="")
+					should_run_historical_search = True
 
-			if content == "Equal":
-				return 1
+			self.update_last_online()
+			self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
 
-			day = message.created_at
+		tenants = list(self.configured_tenants.values())
+		results = await asyncio.gather(*(tenant.catch_up(should_run_historical_search, reconnected) for tenant in tenants), return_exceptions = True) # Each guild publishes as soon as its own search is done
 
-			if content == "Equal 🎄" and day.month == 12 and day.day == 25: # Allow Christmas emote
-				return 1
+		for tenant, result in zip(tenants, results):
+			if isinstance(result, Exception):
+				print(f"\tUnable to catch up guild {self.guild_name(tenant)}: {result}")
 
-			if content == "Equal 🎂": # Allow birthdays
-				if self.birthday_cache[day.month - 1][day.day - 1]: # 2d matrix of birthdays, zero-based
-					return 1
+		print("Readied")
 
-			return -1
+	async def message_handle(self, message: discord.Message, edited: bool = False):
+		if message.guild is None: # Unmanaged, DMs
+			if not edited:
+				await self.command_handle(message)
 
-	def get_balance(self, user_id: int) -> int:
-		user_id = str(user_id)
-		chaos_data = _read_json(self.chaos_file_path)
+			return
 
-		if user_id not in chaos_data:
-			return 0
+		tenant = self.tenant_for(message.guild.id)
 
-		return chaos_data[user_id]["points"] - chaos_data[user_id]["chaos_posts"].__len__() * 50
+		if tenant is None: # Not a guild we're set up for
+			return
 
-	async def message_handle(self, message: discord.Message, edited: bool = False):
-		if message.guild is None and not edited: # Unmanaged, DMs
-			contents = message.clean_content.lower().replace("\n", " ").split(" ")
+		async with tenant.user_locks.hold(message.author.id): # Edits race the message they edit, keep each user's in order
+			await self.guild_message_handle(tenant, message, edited)
 
-			cmd, args = contents[0], contents[1:]
-			del contents
+	async def command_handle(self, message: discord.Message):
+		contents = message.clean_content.lower().replace("\n", " ").split(" ")
 
-			if cmd == "bday": # Should I check if someone changes their bday a bunch to be able to post 🎂's? No, rate limiting for something like this? No
-				if args.__len__() == 2:
-					month, day = args
-					del args
+		cmd, args = contents[0], contents[1:]
+		del contents
 
+		if cmd == "rules" and message.author.id in self.admin_user_ids and args[:1] == ["reload"]:
+			try:
+				self.reload_rules()
+			except (OSError, ValueError, KeyError) as error:
+				await message.reply(embed = discord.Embed(title = "rules reload Command", description = "Unable to reload rules, keeping the current ones", color = discord.Color.red())\
+					.add_field(name = "Error", value = f"{error}"), mention_author=False)
+			else:
+				await message.reply(embed = discord.Embed(title = "rules reload Command", description = "Rules reloaded from config/bot.json", color = discord.Color.green()), mention_author=False)
+
+		elif cmd == "metrics" and message.author.id in self.admin_user_ids:
+			if metrics.enabled:
+				await message.reply(content = f"```\n{metrics.summary()[:1900]}\n```", mention_author=False)
+			else:
+				await message.reply(embed = discord.Embed(title = "metrics Command", description = "Metrics are turned off", color = discord.Color.red())\
+					.add_field(name = "Metrics Enabled", value = "Set it to true in config/bot.json and restart"), mention_author=False)
+
+		elif cmd == "guild":
+			tenant = self.tenants.get(int(args[0])) if args.__len__() == 1 and args[0].isdigit() else None
+
+			if tenant is None:
+				await message.reply(embed = discord.Embed(title = "guild Command", description = "Use `guild` **<**`server id`**>**", color = discord.Color.dark_blue())\
+					.add_field(name = "Servers", value = "\n".join(self.guild_name(tenant) for tenant in self.tenants.values()) or "No servers yet"), mention_author=False)
+			else:
+				self.chosen_tenants[message.author.id] = tenant
+				await message.reply(embed = discord.Embed(title = "guild Command", description = f"Your commands are now for {self.guild_name(tenant)}", color = discord.Color.green()), mention_author=False)
+
+		elif cmd in ("bday", "chaos"):
+			tenant = await self.command_tenant(message)
+
+			if tenant is not None:
+				async with tenant.user_locks.hold(message.author.id): # Balance checks and posts read then write the same user
+					await self.tenant_command_handle(tenant, message, cmd, args)
+
+	async def tenant_command_handle(self, tenant: GuildTenant, message: discord.Message, cmd: str, args: List[str]):
+		if cmd == "bday": # Should I check if someone changes their bday a bunch to be able to post 🎂's? No, rate limiting for something like this? No
+			if args.__len__() == 2:
+				month, day = args
+				del args
+
+				try:
+					month = _months.index(month) % 12
+				except ValueError:
+					await message.reply(embed = discord.Embed(title = "bday Command", description = "Invalid month", color = discord.Color.red())\
+						.add_field(name = "month", value = f"The month can be a three letter abbreviation (Jan, Feb, Nov, or Dec), full names (April, August, September, or July), or a number (3, 5, 6, or 10)\n\nNot \"{month}\""), mention_author=False)
+				else:
 					try:
-						month = _months.index(month) % 12
+						day = int(day) # Could check length before too as a number over 2 digits isn't allowed
 					except ValueError:
-						await message.reply(embed = discord.Embed(title = "bday Command", description = "Invalid month", color = discord.Color.red())\
-							.add_field(name = "month", value = f"The month can be a three letter abbreviation (Jan, Feb, Nov, or Dec), full names (April, August, September, or July), or a number (3, 5, 6, or 10)\n\nNot \"{month}\""), mention_author=False)
+						await message.reply(embed = discord.Embed(title = "bday Command", description = "Invalid day", color = discord.Color.red())\
+							.add_field(name = "day", value = f"The day must be a number\n\nNot \"{day}\""), mention_author=False)
 					else:
-						try:
-							day = int(day) # Could check length before too as a number over 2 digits isn't allowed
-						except ValueError:
-							await message.reply(embed = discord.Embed(title = "bday Command", description = "Invalid day", color = discord.Color.red())\
-								.add_field(name = "day", value = f"The day must be a number\n\nNot \"{day}\""), mention_author=False)
-
-						
-						if day < 1 or day > self.birthday_cache[month].__len__():
+						if day < 1 or day > tenant.birthdays.days_in(month + 1):
 							await message.reply(embed = discord.Embed(title = "bday Command", description = "Invalid day", color = discord.Color.red())\
-								.add_field(name = "day", value = f"The day must be between 1 and {self.birthday_cache[month].__len__()}, {day} isn't"), mention_author=False)
+								.add_field(name = "day", value = f"The day must be between 1 and {tenant.birthdays.days_in(month + 1)}, {day} isn't"), mention_author=False)
 						else:
-							user_id = str(message.author.id)
-							birthday_data = _read_json(os.path.join(_project_root, "data", "birthdays.json"))
-
-							if user_id in birthday_data:
-								old_birthday = birthday_data[user_id].copy()
-
-								if old_birthday.get("month") == month + 1 and old_birthday.get("day") == day: # Same day
-									await message.reply(embed = discord.Embed(title = "bday Command", description = f"{_months[month + 12].title()} {day} is already your birthday!", color = discord.Color.red()), mention_author=False)
-									self.update_last_online()
-									return
-
-							self.birthday_cache[month][day - 1] += 1 # Modify loaded cache
-							birthday_data[user_id] = {"month": month + 1, "day": day}
-							_write_json(os.path.join(_project_root, "data", "birthdays.json"), birthday_data)
+							if tenant.birthdays.get(str(message.author.id)) == (month + 1, day): # Same day
+								await message.reply(embed = discord.Embed(title = "bday Command", description = f"{_months[month + 12].title()} {day} is already your birthday!", color = discord.Color.red()), mention_author=False)
+								return
 
-							if user_id in birthday_data:
-								self.birthday_cache[old_birthday.get("month") - 1][old_birthday.get("day") - 1] -= 1 # Modify loaded cache
+							old_birthday = tenant.birthdays.set(str(message.author.id), month + 1, day)
 
+							if old_birthday is not None:
 								await message.reply(embed = discord.Embed(title = "bday Command", description = "Birthday set!", color = discord.Color.green())\
-									.add_field(name = "Updated from", value = f"{_months[old_birthday.get('month') + 11].title()} {old_birthday.get('day')}")\
+									.add_field(name = "Updated from", value = f"{_months[old_birthday[0] + 11].title()} {old_birthday[1]}")\
 									.add_field(name = "To", value = f"{_months[month + 12].title()} {day}"), mention_author=False)
 
 							else:
 								await message.reply(embed = discord.Embed(title = "bday Command", description = "Birthday set!", color = discord.Color.green())\
 									.add_field(name = "Birthday set to", value = f"{_months[month + 12].title()} {day}"), mention_author=False)
-				else:
-					await message.reply(embed = discord.Embed(title = "bday Command", description = "Use `bday` **<**`month`**>** **<**`day`**>**", color = discord.Color.dark_blue())\
-						.add_field(name = "month", value = "The month can be a three letter abbreviation (Jan, Feb, Nov, or Dec), full names (April, August, September, or July), or a number (3, 5, 6, or 10)", inline = False)\
-						.add_field(name = "day", value = "The day must be a number (1 to 28/29/30/31)", inline = False), mention_author=False)
+			else:
+				await message.reply(embed = discord.Embed(title = "bday Command", description = "Use `bday` **<**`month`**>** **<**`day`**>**", color = discord.Color.dark_blue())\
+					.add_field(name = "month", value = "The month can be a three letter abbreviation (Jan, Feb, Nov, or Dec), full names (April, August, September, or July), or a number (3, 5, 6, or 10)", inline = False)\
+					.add_field(name = "day", value = "The day must be a number (1 to 28/29/30/31)", inline = False), mention_author=False)
+
+		elif cmd == "chaos":
+			if args.__len__():
+				subcommand = args[0].lower()
+				args = args[1:]
 
-			elif cmd == "chaos":
-				if args.__len__():
-					subcommand = args[0].lower()
-					args = args[1:]
+				if subcommand == "balance":
+					await message.reply(embed = discord.Embed(title = "chaos balance Command", description = f"Your balance is {tenant.get_balance(message.author.id)}", color = discord.Color.green()), mention_author=False)
 
-					if subcommand == "balance":
-						await message.reply(embed = discord.Embed(title = "chaos balance Command", description = f"Your balance is {self.get_balance(message.author.id)}", color = discord.Color.green()), mention_author=False)
+				elif subcommand == "post":
+					balance = tenant.get_balance(message.author.id)
+
+					if balance < 50:
+						await message.reply(embed = discord.Embed(title = "chaos post Command", description = "Insufficient funds", color = discord.Color.red())\
+							.add_field(name = "It costs 50 chaos points to make a chaotic post", value = f"Your balance is {balance}"), mention_author=False)
+					else:
+						to_post = message.clean_content[11:]
+						tenant.posts_to_confirm[message.author.id] = to_post
 
-					elif subcommand == "post":
-						balance = self.get_balance(message.author.id)
+						await message.reply(embed = discord.Embed(title = "chaos post Command", description = "Confirm post", color = discord.Color.green())\
+							.add_field(name = f"You'll have {balance - 50} chaos point{'' if (balance - 50) == 1 else 's'} left, confirm post below", value = f"{to_post}", inline = False)\
+							.add_field(name = "Use `chaos confirm` to make this post", value = "This will take 50 chaos points", inline = False)\
+							.add_field(name = "Use `chaos cancel` to cancel this post", value = "This will cancel this post", inline = False), mention_author=False)
+
+				elif subcommand == "confirm":
+					if message.author.id in tenant.posts_to_confirm:
+						balance = tenant.get_balance(message.author.id)
 
 						if balance < 50:
-							await message.reply(embed = discord.Embed(title = "chaos post Command", description = "Insufficient funds", color = discord.Color.red())\
+							del tenant.posts_to_confirm[message.author.id]
+							await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "Insufficient funds", color = discord.Color.red())\
 								.add_field(name = "It costs 50 chaos points to make a chaotic post", value = f"Your balance is {balance}"), mention_author=False)
 						else:
-							to_post = message.clean_content[11:]
-							self.posts_to_confirm[message.author.id] = to_post
-
-							await message.reply(embed = discord.Embed(title = "chaos post Command", description = "Confirm post", color = discord.Color.green())\
-								.add_field(name = f"You'll have {balance - 50} chaos point{'' if (balance - 50) == 1 else 's'} left, confirm post below", value = f"{to_post}", inline = False)\
-								.add_field(name = "Use `chaos confirm` to make this post", value = "This will take 50 chaos points", inline = False)\
-								.add_field(name = "Use `chaos cancel` to cancel this post", value = "This will cancel this post", inline = False), mention_author=False)
-
-					elif subcommand == "confirm":
-						if message.author.id in self.posts_to_confirm:
-							balance = self.get_balance(message.author.id)
-
-							if balance < 50:
-								del self.posts_to_confirm[message.author.id]
-								await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "Insufficient funds", color = discord.Color.red())\
-									.add_field(name = "It costs 50 chaos points to make a chaotic post", value = f"Your balance is {balance}"), mention_author=False)
-							else:
-								chaos_channel: discord.TextChannel = self.get_channel(self.chaos_channel_id)
-
-								if chaos_channel is None:
-									print(f"Unable to post to chaos channel, couldn't find channel with id \"{self.chaos_channel_id}\"")
-									await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "Post failure", color = discord.Color.red())\
-										.add_field(name = "Cannot post right now", value = "Unable to locate chaos text channel", inline = False), mention_author=False)
+							chaos_channel: discord.TextChannel = self.get_channel(tenant.chaos_channel_id)
 
-								else:
-									post = self.posts_to_confirm[message.author.id]
-									await chaos_channel.send(f"{post}")
+							if chaos_channel is None:
+								print(f"Unable to post to chaos channel, couldn't find channel with id \"{tenant.chaos_channel_id}\"")
+								await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "Post failure", color = discord.Color.red())\
+									.add_field(name = "Cannot post right now", value = "Unable to locate chaos text channel", inline = False), mention_author=False)
 
-									chaos_data = _read_json(self.chaos_file_path)
-									chaos_data[str(message.author.id)]["chaos_posts"].append(post)
-									_write_json(self.chaos_file_path, chaos_data)
+							else:
+								post = tenant.posts_to_confirm[message.author.id]
+								await chaos_channel.send(f"{post}")
 
-									del self.posts_to_confirm[message.author.id]
+								tenant.ledger.add_post(message.author.id, post)
 
-									await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "Post confirmed", color = discord.Color.green()), mention_author=False)
+								tenant.posts_to_confirm.pop(message.author.id) # May have expired while sending
 
-									await self.update_leaderboard()
-						else:
-							await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "No post", color = discord.Color.dark_blue())\
-								.add_field(name = "You need to attempt to make a post before you can confirm one", value = f"Use `chaos post <message>`"), mention_author=False)
+								await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "Post confirmed", color = discord.Color.green()), mention_author=False)
 
-					elif subcommand == "cancel":
-						if message.author.id in self.posts_to_confirm:
-							del self.posts_to_confirm[message.author.id]
-							await message.reply(embed = discord.Embed(title = "chaos cancel Command", description = "Post cancelled", color = discord.Color.green()), mention_author=False)
+								await tenant.update_leaderboard()
+					else:
+						await message.reply(embed = discord.Embed(title = "chaos confirm Command", description = "No post", color = discord.Color.dark_blue())\
+							.add_field(name = "You need to attempt to make a post before you can confirm one", value = f"Use `chaos post <message>`"), mention_author=False)
 
-						else:
-							await message.reply(embed = discord.Embed(title = "chaos cancel Command", description = "No post", color = discord.Color.dark_blue())\
-								.add_field(name = "You need to attempt to make a post before you can cancel one", value = f"Use `chaos post <message>`"), mention_author=False)
+				elif subcommand == "cancel":
+					if message.author.id in tenant.posts_to_confirm:
+						del tenant.posts_to_confirm[message.author.id]
+						await message.reply(embed = discord.Embed(title = "chaos cancel Command", description = "Post cancelled", color = discord.Color.green()), mention_author=False)
 
 					else:
-						await message.reply(embed = discord.Embed(title = "chaos Command", description = "Invalid subcommand", color = discord.Color.red())\
-							.add_field(name = "balance", value = "Get your balance of chaos points", inline = False)\
-							.add_field(name = "post", value = "Send a chaotic message at the cost of 50 chaos points", inline = False)\
-							.add_field(name = "confirm", value = "Confirm to send a chaotic message", inline = False)\
-							.add_field(name = "cancel", value = "Cancel the posting of a chaotic message", inline = False), mention_author=False)
+						await message.reply(embed = discord.Embed(title = "chaos cancel Command", description = "No post", color = discord.Color.dark_blue())\
+							.add_field(name = "You need to attempt to make a post before you can cancel one", value = f"Use `chaos post <message>`"), mention_author=False)
 
 				else:
-					await message.reply(embed = discord.Embed(title = "chaos Command", description = "chaos subcommands:", color = discord.Color.dark_blue())\
+					await message.reply(embed = discord.Embed(title = "chaos Command", description = "Invalid subcommand", color = discord.Color.red())\
 						.add_field(name = "balance", value = "Get your balance of chaos points", inline = False)\
 						.add_field(name = "post", value = "Send a chaotic message at the cost of 50 chaos points", inline = False)\
 						.add_field(name = "confirm", value = "Confirm to send a chaotic message", inline = False)\
 						.add_field(name = "cancel", value = "Cancel the posting of a chaotic message", inline = False), mention_author=False)
 
-		else: # Managed, Guilds
-			check = await self.check_message(message)
+			else:
+				await message.reply(embed = discord.Embed(title = "chaos Command", description = "chaos subcommands:", color = discord.Color.dark_blue())\
+					.add_field(name = "balance", value = "Get your balance of chaos points", inline = False)\
+					.add_field(name = "post", value = "Send a chaotic message at the cost of 50 chaos points", inline = False)\
+					.add_field(name = "confirm", value = "Confirm to send a chaotic message", inline = False)\
+					.add_field(name = "cancel", value = "Cancel the posting of a chaotic message", inline = False), mention_author=False)
+
+	async def guild_message_handle(self, tenant: GuildTenant, message: discord.Message, edited: bool = False):
+		check = tenant.check_message(message)
+
+		if metrics.enabled:
+			metrics.inc("messages_checked_total", outcome = {1: "accepted", -1: "rejected"}.get(check, "ignored"), edited = str(edited).lower())
+
+		if check == 1:
+			tenant.clear_reactions(message) # Bad ones are deleted anyway
 
-			if check == 1:
-				if not edited: # Prevent infinite points from editing messages on Christmas or a birthday
-					await self.increase_chaos(message.author.id, message.author.name)
+			if not edited: # Prevent infinite points from editing messages on Christmas or a birthday
+				await tenant.increase_chaos(message.author.id, message.author.name, message.id)
 
-			elif check == -1:
-				await message.delete()
+		elif check == -1:
+			self.outbound.delete(message)
 
-				if edited: # They would've gained chaos so take away chaos
-					await self.decrease_chaos(message.author.id, message.author.name)
-		
-		self.update_last_online()
+			if edited: # They would've gained chaos so take away chaos
+				await tenant.decrease_chaos(message.author.id, message.author.name)
+			else:
+				tenant.ledger.advance(message.id)
+
+	async def close(self):
+		if self.is_closed(): # discord.py can call this more than once on the way out
+			return
+
+		await asyncio.gather(*(tenant.leaderboard.close() for tenant in self.configured_tenants.values()))
+		await self.outbound.close()
+		await metrics.close()
+
+		for tenant in self.configured_tenants.values():
+			await tenant.close() # Write out anything still pending before disconnecting
+
+		if self.heartbeat_task is not None:
+			self.heartbeat_task.cancel()
+			self.update_last_online(True) # Lets the next start know nothing was lost
+		await super().close()
 
 	async def on_message(self, message: discord.Message):
-		await self.message_handle(message)
+		with metrics.timer("handler_seconds", handler = "on_message"):
+			await self.message_handle(message)
 
 	async def on_message_edit(self, _, after_message: discord.Message):
-		await self.message_handle(after_message, True)
+		with metrics.timer("handler_seconds", handler = "on_message_edit"):
+			await self.message_handle(after_message, True)
+
+	async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+		if payload.cached_message is None: # on_message_edit only fires for messages still in the message cache
+			with metrics.timer("handler_seconds", handler = "on_raw_message_edit"):
+				await self.message_handle(payload.message, True)
 
 	async def on_member_join(self, member: discord.member.Member):
-		equal_role = discord.utils.get(member.guild.roles, id = self.equal_role_id) # Get Equal role
+		with metrics.timer("handler_seconds", handler = "on_member_join"):
+			tenant = self.tenant_for(member.guild.id)
 
-		if equal_role is None:
-			print(f"Unable to assign Equal role as a role couldn't be found with id \"{self.equal_role_id}\"")
-		else:
-			await member.edit(nick = "Equal", roles = [equal_role], reason = "To make us all Equal") # Set nickname and roles
+			if tenant is not None:
+				tenant.assign_equal_role(member)
 
 def main():
 	config_path = os.path.join(_project_root, "config")
@@ -410,10 +464,34 @@ def main():
 	if not os.path.isfile(bot_config_path):
 		_write_json(bot_config_path, {
 			"Historical Search Threshold (in seconds)": 600,
+			"Heartbeat Interval (in seconds)": 60,
+			"Shard Count": None,
+			"Low Memory Mode": False,
+			"Message Cache Size": None,
+			"Storage Backend": "json",
 			"Leaderboard Channel ID": None,
 			"Equal Channel ID": None,
 			"Equal Role ID": None,
-			"Historical Purge": False
+			"Historical Purge": False,
+			"Historical Search Mode": "incremental",
+			"Historical Search Partitions": 8,
+			"Historical Search Concurrency": 4,
+			"Historical Search Workers": 4,
+			"Historical Search Retry Delay (in seconds)": 30,
+			"Chaos Flush Interval (in seconds)": 30,
+			"Chaos Flush Threshold": 100,
+			"Chaos Journal Compaction Threshold": 1000,
+			"Birthday Flush Interval (in seconds)": 30,
+			"Chaos Post Confirm Timeout (in seconds)": 600,
+			"Leaderboard Update Window (in seconds)": 5,
+			"Leaderboard Rows Per Page": None,
+			"Outbound Bucket Interval (in seconds)": 0.25,
+			"Outbound Concurrency": 4,
+			"Metrics Enabled": False,
+			"Metrics Host": "127.0.0.1",
+			"Metrics Port": 9108,
+			"Admin User IDs": [],
+			"Message Rules": DEFAULT_RULES
 		}, True) # Write default config so we don't have to ship it
 
 	data_path = os.path.join(_project_root, "data")
@@ -0,0 +1,111 @@
+from typing import Dict, Optional, Tuple
+from storage import Storage
+import asyncio
+
+# Everyone's birthday held in memory as both user -> (month, day) and a per day count, so setting one is a pair of O(1)
+# updates and checking a day is a single index. Changes are written to storage in batches by a background task
+
+class BirthdayIndex:
+
+	def __init__(self, storage: Storage, flush_interval: float = 30):
+		self.storage = storage
+		self.flush_interval = flush_interval
+
+		self.counts = [ # 2d matrix making a calendar
+			[0] * 31, [0] * 29, [0] * 31, [0] * 30,
+			[0] * 31, [0] * 30, [0] * 31, [0] * 31,
+			[0] * 30, [0] * 31, [0] * 30, [0] * 31
+		]
+		self.users: Dict[str, Tuple[int, int]] = {} # Month and day are one-based
+
+		self.pending: Dict[str, dict] = {}
+
+		self._flush_requested: Optional[asyncio.Event] = None
+		self._flush_task: Optional[asyncio.Task] = None
+		self._closing = False
+
+		for user_id, birthday in storage.load_birthdays().items():
+			if not isinstance(birthday, dict):
+				raise ValueError("Invalid birthday entry, must be a dictionary")
+
+			try:
+				month = int(birthday.get("month", 13))
+			except ValueError:
+				raise ValueError(f"Invalid month, must be a number, not \"{birthday.get('month')}\"")
+
+			try:
+				day = int(birthday.get("day", 32))
+			except ValueError:
+				raise ValueError(f"Invalid day, must be a number, not \"{birthday.get('day')}\"")
+
+			if month < 1 or month > 12:
+				raise ValueError(f"Invalid month \"{month}\", must be 1 <= month <= 12")
+
+			if day < 1 or day > self.days_in(month):
+				raise ValueError(f"Invalid day \"{day}\", must be 1 <= day <= {self.days_in(month)}")
+
+			self.users[user_id] = (month, day)
+			self.counts[month - 1][day - 1] += 1
+
+	def days_in(self, month: int) -> int:
+		return self.counts[month - 1].__len__()
+
+	def get(self, user_id: str) -> Optional[Tuple[int, int]]:
+		return self.users.get(user_id)
+
+	def set(self, user_id: str, month: int, day: int) -> Optional[Tuple[int, int]]: # Returns the birthday it replaced
+		old = self.users.get(user_id)
+
+		if old is not None:
+			self.counts[old[0] - 1][old[1] - 1] -= 1
+
+		self.users[user_id] = (month, day)
+		self.counts[month - 1][day - 1] += 1
+		self.pending[user_id] = {"month": month, "day": day}
+
+		return old
+
+	def on(self, month: int, day: int) -> bool: # Whether it's anyone's birthday
+		return self.counts[month - 1][day - 1] > 0
+
+	def flush(self):
+		if self.pending.__len__():
+			changes, self.pending = self.pending, {}
+			self.storage.set_birthdays(changes)
+
+	async def _flush_loop(self):
+		while not self._closing:
+			try:
+				await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+			except asyncio.TimeoutError:
+				pass
+
+			self._flush_requested.clear()
+
+			if not self.pending.__len__():
+				continue
+
+			changes, self.pending = self.pending, {}
+
+			try:
+				await asyncio.get_running_loop().run_in_executor(None, self.storage.set_birthdays, changes)
+			except Exception as error:
+				print(f"Unable to save birthdays: {error}")
+				self.pending = {**changes, **self.pending} # Newer changes win
+
+	def start(self):
+		if self._flush_task is None:
+			self._flush_requested = asyncio.Event()
+			self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+	async def close(self):
+		if self._flush_task is not None:
+			self._closing = True
+			self._flush_requested.set()
+			await self._flush_task
+
+			self._flush_task = None
+			self._closing = False
+			self._flush_requested = None
+
+		self.flush()
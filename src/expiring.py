@@ -0,0 +1,54 @@
+from typing import Hashable, Iterator, Optional, Tuple
+from collections import OrderedDict
+import time
+
+# A dict whose entries are dropped a fixed time after they were last set. Entries are kept in the order they were set,
+# which is also the order they expire in, so evicting only ever pops expired entries off the front
+
+class ExpiringDict:
+
+	def __init__(self, ttl: Optional[float] = None): # None never expires
+		self.ttl = ttl
+		self.entries: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict() # key -> (expires at, value), oldest first
+
+	def _evict(self):
+		if self.ttl is None:
+			return
+
+		now = time.monotonic()
+
+		while self.entries.__len__():
+			key = next(iter(self.entries))
+
+			if self.entries[key][0] > now:
+				break
+
+			self.entries.popitem(last = False)
+
+	def __setitem__(self, key: Hashable, value: object):
+		self._evict()
+		self.entries[key] = (time.monotonic() + self.ttl if self.ttl is not None else 0, value)
+		self.entries.move_to_end(key) # Setting again restarts its time
+
+	def __getitem__(self, key: Hashable) -> object:
+		self._evict()
+		return self.entries[key][1]
+
+	def __delitem__(self, key: Hashable):
+		del self.entries[key]
+
+	def pop(self, key: Hashable, default: object = None) -> object:
+		entry = self.entries.pop(key, None)
+		return default if entry is None else entry[1]
+
+	def __contains__(self, key: Hashable) -> bool:
+		self._evict()
+		return key in self.entries
+
+	def __len__(self) -> int:
+		self._evict()
+		return self.entries.__len__()
+
+	def __iter__(self) -> Iterator[Hashable]:
+		self._evict()
+		return iter(list(self.entries))
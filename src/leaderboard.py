@@ -0,0 +1,144 @@
+from typing import Awaitable, Callable, List, Optional
+from util import _read_json, _write_json
+from outbound import OutboundScheduler, PRIORITY_LEADERBOARD
+from metrics import metrics
+import asyncio
+import discord
+import time
+import os
+
+# Owns the bot's leaderboard pages, one message per page in order. Their ids are cached in data/leaderboard.json so
+# updates go straight to edits, the channel history is only walked when nothing is cached. Requests are coalesced to at
+# most one round of edits per window, always rendering the latest state, and only pages whose text changed are edited.
+# Publishes run one at a time, so two can never both find a page missing and send it
+
+class LeaderboardPublisher:
+
+	def __init__(self, client: discord.Client, channel_id: int, state_path: str, render: Callable[[], Awaitable[List[str]]], window: float = 5,
+			outbound: Optional[OutboundScheduler] = None):
+		self.client = client
+		self.channel_id = channel_id
+		self.state_path = state_path
+		self.render = render
+		self.window = window
+		self.outbound = outbound # Edits wait behind moderation when given
+
+		self.message_ids: List[int] = []
+		self.last_contents: List[str] = [] # What each page was last edited to by this process
+		self.last_edit = 0.0
+		self.requested = False
+		self._task: Optional[asyncio.Task] = None
+		self._publishing = asyncio.Lock() # The coalesced publish, catch up's and close's all go through it
+
+		if os.path.isfile(state_path):
+			state = _read_json(state_path)
+
+			if "message_ids" in state:
+				self.message_ids = state["message_ids"]
+			elif state.get("message_id") is not None: # Single message leaderboard
+				self.message_ids = [state["message_id"]]
+
+	def _remember(self, message_ids: List[int]):
+		self.message_ids = message_ids
+		_write_json(self.state_path, {"message_ids": message_ids})
+
+	async def _discover(self, channel: discord.TextChannel) -> List[int]:
+		return [message.id async for message in channel.history(oldest_first = True, limit = None) if message.author.id == self.client.user.id]
+
+	async def publish(self):
+		async with self._publishing:
+			await self._publish()
+
+	async def _publish(self): # Only with _publishing held
+		channel: discord.TextChannel = self.client.get_channel(self.channel_id)
+
+		if channel is None:
+			print(f"Unable to update leaderboard, couldn't find channel with id \"{self.channel_id}\"")
+			return
+
+		pages = await self.render()
+
+		if pages == self.last_contents: # Nothing moved
+			return
+
+		self.last_edit = time.monotonic()
+
+		if not self.message_ids.__len__():
+			self._remember(await self._discover(channel))
+
+		message_ids = self.message_ids.copy()
+		contents = self.last_contents[:message_ids.__len__()]
+
+		try:
+			for page, content in enumerate(pages):
+				if page < message_ids.__len__():
+					if page < contents.__len__() and contents[page] == content:
+						continue
+
+					try:
+						await channel.get_partial_message(message_ids[page]).edit(content = content)
+						metrics.inc("leaderboard_messages_total", action = "edit")
+					except discord.NotFound: # Deleted since we cached it, pages below it get resent so they stay in order
+						print(f"Leaderboard page message {message_ids[page]} is gone, resending the pages from it down")
+						await self._delete(channel, message_ids[page + 1:])
+						del message_ids[page:], contents[page:]
+					else:
+						contents[page:page + 1] = [content]
+						continue
+
+				message = await channel.send(content = content)
+				metrics.inc("leaderboard_messages_total", action = "send")
+				message_ids.append(message.id)
+				contents.append(content)
+
+			if message_ids.__len__() > pages.__len__(): # Fewer pages than before
+				await self._delete(channel, message_ids[pages.__len__():])
+				del message_ids[pages.__len__():], contents[pages.__len__():]
+		finally: # Keep whatever got sent even if a later page failed
+			if message_ids != self.message_ids:
+				self._remember(message_ids)
+
+			self.last_contents = contents
+
+	async def _delete(self, channel: discord.TextChannel, message_ids: List[int]):
+		for message_id in message_ids:
+			try:
+				await channel.get_partial_message(message_id).delete()
+				metrics.inc("leaderboard_messages_total", action = "delete")
+			except discord.NotFound:
+				pass
+
+	async def _run(self):
+		while self.requested:
+			wait = self.last_edit + self.window - time.monotonic()
+
+			if wait > 0:
+				await asyncio.sleep(wait) # Anything requested meanwhile is picked up by this same edit
+
+			self.requested = False
+
+			try:
+				if self.outbound is None:
+					await self.publish()
+				else:
+					await self.outbound.call(("leaderboard", self.channel_id), PRIORITY_LEADERBOARD, self.publish, ("leaderboard", self.channel_id)) # Coalesced per channel, each guild has its own
+			except discord.HTTPException as error:
+				print(f"Unable to update leaderboard: {error}")
+
+	def request(self):
+		self.requested = True
+
+		if self._task is None or self._task.done():
+			self._task = asyncio.ensure_future(self._run())
+
+	async def close(self):
+		if self._task is not None and not self._task.done(): # Get the final state out now rather than after the window
+			self._task.cancel()
+
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+
+			self.requested = False
+			await self.publish()
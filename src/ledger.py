@@ -0,0 +1,290 @@
+from typing import Union, Dict, List, Optional, Tuple
+from util import POST_COST
+from ranking import LeaderboardIndex
+from storage import Storage
+import asyncio
+import copy
+
+# Every change is a record with an increasing sequence number, applied in memory straight away and handed to storage in
+# batches by a background task. Storages that only append (JSON) get the whole state written as a snapshot once enough
+# records pile up, others have an incremental search's deltas written straight to the users it touched. Users only carry
+# how many chaos posts they've made, the text goes to storage with the record and isn't kept in memory. The checkpoint is the newest #equal message already counted, records for live messages carry it as
+# "msg" so points and checkpoint always land on disk together. While a search is catching up, points from live messages
+# are held in memory only and go to disk once it's done, so a search that fails or is cut short by shutdown leaves the
+# disk at the old checkpoint and the next one counts them exactly once. Every write goes through one lock so a snapshot
+# from a finished search never overlaps the flush task's
+
+class ChaosLedger:
+
+	def __init__(self, storage: Storage, flush_interval: float = 30, flush_threshold: int = 100, compaction_threshold: int = 1000):
+		self.storage = storage
+		self.flush_interval = flush_interval
+		self.flush_threshold = flush_threshold
+		self.compaction_threshold = compaction_threshold
+
+		self.users: Dict[str, dict] = {}
+		self.seq = 0 # Last sequence number applied in memory
+		self.snapshot_seq = 0 # Last sequence number folded into the snapshot on disk
+		self.journal_records = 0 # Records on disk past the snapshot
+		self.checkpoint = 0 # Newest equal channel message id counted, 0 if unknown
+
+		self.holding = False # Catching up on what was missed, keep live messages from moving the checkpoint past it
+		self.held_records: List[Tuple[dict, Optional[int]]] = [] # (record, message it came from), applied in memory but kept off disk
+		self.held_checkpoint = 0 # Newest live message seen while holding
+		self.held_first = 0 # Oldest live message seen while holding, anything older has to come from the search
+
+		self.ranking = LeaderboardIndex()
+
+		self.pending: List[dict] = [] # Records applied in memory but not yet appended to the journal
+		self._flush_requested: Optional[asyncio.Event] = None
+		self._flush_task: Optional[asyncio.Task] = None
+		self._closing = False
+		self._writing = asyncio.Lock() # One write to storage at a time, whether from the flush task or a search finishing
+
+		self.load()
+
+	def load(self):
+		self.users, self.seq, self.checkpoint, records = self.storage.load_chaos()
+		self.snapshot_seq = self.seq
+
+		for record in records:
+			self.apply(record)
+			self.seq = record["seq"]
+
+		self.journal_records = records.__len__()
+		self.ranking.reset(self.users)
+
+	def exists(self) -> bool:
+		return self.storage.chaos_exists()
+
+	def apply(self, record: dict):
+		op, user_id = record["op"], record["id"]
+
+		if record.get("msg", 0) > self.checkpoint:
+			self.checkpoint = record["msg"]
+
+		if user_id not in self.users:
+			self.users[user_id] = {"name": record.get("name", user_id), "points": 0, "posts": 0}
+
+		user = self.users[user_id]
+
+		if op == "inc":
+			user["points"] += 1
+
+		elif op == "dec":
+			user["points"] -= 1
+
+			if user["points"] < 0: # Prevent negative
+				user["points"] = 0
+
+		elif op == "post": # Only counted, the text is left to storage
+			user["posts"] += 1
+
+		else:
+			raise ValueError(f"Unknown chaos journal operation \"{op}\"")
+
+		self.ranking.update(user_id, user)
+
+	def record(self, op: str, user_id: Union[int, str], message_id: Optional[int] = None, **fields):
+		self.seq += 1
+		record = {"seq": self.seq, "op": op, "id": str(user_id), **fields}
+
+		if self.holding and op != "post": # The search may count these again, posts can't come from the equal channel
+			self.apply(record)
+			self.held_records.append((record, message_id))
+			self.advance(message_id or 0)
+			return
+
+		if message_id is not None:
+			record["msg"] = message_id
+
+		self.apply(record)
+		self.pending.append(record)
+		self.mark_dirty()
+
+	def advance(self, message_id: int): # A message was looked at but changed no points, persisted with the next snapshot
+		if self.holding:
+			if message_id > self.held_checkpoint:
+				self.held_checkpoint = message_id
+
+			if message_id and (not self.held_first or message_id < self.held_first):
+				self.held_first = message_id
+
+		elif message_id > self.checkpoint:
+			self.checkpoint = message_id
+
+	def balance(self, user_id: Union[int, str]) -> int:
+		user = self.users.get(str(user_id))
+
+		if user is None:
+			return 0
+
+		return user["points"] - user["posts"] * POST_COST
+
+	def ranked(self) -> List[dict]:
+		return [self.users[user_id] for user_id in self.ranking.ranked()]
+
+	def increase(self, user_id: Union[int, str], user_name: str, message_id: Optional[int] = None):
+		self.record("inc", user_id, message_id, name = user_name)
+
+	def decrease(self, user_id: Union[int, str], user_name: str, message_id: Optional[int] = None):
+		self.record("dec", user_id, message_id, name = user_name)
+
+	def add_post(self, user_id: Union[int, str], post: str):
+		self.record("post", user_id, post = post)
+
+	def hold(self): # Holding again keeps what's already been held
+		if not self.holding:
+			self.holding = True
+			self.held_records = []
+			self.held_checkpoint = 0
+			self.held_first = 0
+
+	def release(self): # What was held goes to disk from here on
+		for record, message_id in self.held_records:
+			self.seq += 1
+			record["seq"] = self.seq # Renumbered after anything appended while they were held
+
+			if message_id is not None:
+				record["msg"] = message_id
+
+			self.pending.append(record)
+
+		if self.held_checkpoint > self.checkpoint:
+			self.checkpoint = self.held_checkpoint
+
+		self.holding = False
+		self.held_records = []
+		self.held_checkpoint = 0
+		self.held_first = 0
+		self.mark_dirty()
+
+	async def replace(self, chaos_data: Dict[str, dict], checkpoint: int): # Swap in a rebuilt ledger, written out immediately
+		for user_id, user in self.users.items(): # Chaos posts can't be recovered from the equal channel, carry them over
+			if user["posts"]:
+				chaos_data.setdefault(user_id, {"name": user["name"], "points": 0, "posts": 0})["posts"] = user["posts"]
+
+		self.users = chaos_data
+		self.ranking.reset(self.users)
+
+		for record, _ in self.held_records: # Live messages that arrived during the rebuild aren't in its history
+			self.apply(record)
+
+		self.checkpoint = checkpoint
+		self.release()
+		await self.compact_async()
+
+	async def merge(self, chaos_deltas: Dict[str, dict], checkpoint: int): # Fold in what an incremental search found, written out immediately
+		if not self.storage.compacts: # Only the rows of users the search found are updated, before memory so a failure leaves both as they were
+			async with self._writing:
+				await asyncio.get_running_loop().run_in_executor(None, self.storage.merge_chaos, chaos_deltas, checkpoint)
+
+		for user_id, delta in chaos_deltas.items():
+			if user_id not in self.users:
+				self.users[user_id] = {"name": delta["name"], "points": 0, "posts": 0}
+
+			self.users[user_id]["points"] += delta["points"]
+			self.ranking.update(user_id, self.users[user_id])
+
+		if checkpoint > self.checkpoint:
+			self.checkpoint = checkpoint
+
+		self.release()
+
+		if self.storage.compacts:
+			await self.compact_async()
+
+	def mark_dirty(self):
+		if self.pending.__len__() >= self.flush_threshold and self._flush_requested is not None:
+			self._flush_requested.set() # Let the background task do the write, never the caller
+
+	def compact(self): # Synchronous, only for when nothing else can be writing (shutdown)
+		self.storage.write_chaos_snapshot(self.users, self.seq, self.checkpoint)
+		self.snapshot_seq = self.seq
+		self.journal_records = 0
+		self.pending = [] # All in the snapshot, appending them as well would apply them twice
+
+	def flush(self):
+		if self.pending.__len__():
+			self.storage.append_chaos(self.pending)
+			self.journal_records += self.pending.__len__()
+			self.pending = []
+
+		if self.holding: # A snapshot would take the held points with it
+			return
+
+		if not self.exists() or (self.storage.compacts and self.journal_records >= self.compaction_threshold):
+			self.compact()
+
+	async def compact_async(self):
+		async with self._writing:
+			await self._write_snapshot()
+
+	async def _write_snapshot(self): # Only with _writing held
+		users, seq, checkpoint = copy.deepcopy(self.users), self.seq, self.checkpoint # Copy on the loop so the executor never sees a dict mid-update
+
+		await asyncio.get_running_loop().run_in_executor(None, self.storage.write_chaos_snapshot, users, seq, checkpoint)
+		self.journal_records = 0
+		self.snapshot_seq = seq
+		self.pending = [record for record in self.pending if record["seq"] > seq] # The rest are in the snapshot, appending them as well would apply them twice
+
+	async def _flush_async(self):
+		async with self._writing:
+			await self._flush_pending()
+
+	async def _flush_pending(self): # Only with _writing held
+		loop = asyncio.get_running_loop()
+
+		if self.pending.__len__():
+			records, self.pending = self.pending, []
+
+			try:
+				await loop.run_in_executor(None, self.storage.append_chaos, records)
+			except Exception:
+				self.pending = records + self.pending # Keep them for the next pass
+				raise
+
+			self.journal_records += records.__len__()
+
+		if self.storage.compacts and self.journal_records >= self.compaction_threshold and not self.holding:
+			await self._write_snapshot()
+
+	async def _flush_loop(self):
+		while not self._closing:
+			try:
+				await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+			except asyncio.TimeoutError:
+				pass
+
+			self._flush_requested.clear()
+
+			try:
+				await self._flush_async()
+			except Exception as error:
+				print(f"Unable to flush chaos ledger: {error}")
+
+	def start(self):
+		if self._flush_task is None:
+			self._flush_requested = asyncio.Event()
+			self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+	async def close(self):
+		if self._flush_task is not None: # Let an in-flight write finish rather than cancelling it halfway through
+			self._closing = True
+			self._flush_requested.set()
+			await self._flush_task
+
+			self._flush_task = None
+			self._closing = False
+			self._flush_requested = None
+
+		async with self._writing: # A search may still be writing its snapshot
+			self.flush()
+
+			if self.holding: # A search never finished, the disk stays at its checkpoint so the next one covers what was held
+				return
+
+			if self.storage.compacts:
+				self.compact() # Leave a clean snapshot so the next start has nothing to replay
+			else:
+				self.storage.write_checkpoint(self.checkpoint) # Messages that changed no points only moved it in memory
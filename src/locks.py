@@ -0,0 +1,31 @@
+from typing import AsyncIterator, Dict, Hashable
+import contextlib
+import asyncio
+
+# One asyncio.Lock per user, created on first use and dropped once nobody holds or waits on it. asyncio.Lock wakes
+# waiters in the order they arrived, so a user's events are applied in the order the gateway delivered them while
+# different users never wait on each other
+
+class UserLocks:
+
+	def __init__(self):
+		self.locks: Dict[Hashable, asyncio.Lock] = {}
+		self.users: Dict[Hashable, int] = {} # Holders and waiters per lock
+
+	@contextlib.asynccontextmanager
+	async def hold(self, user_id: Hashable) -> AsyncIterator[None]:
+		lock = self.locks.get(user_id)
+
+		if lock is None:
+			lock = self.locks[user_id] = asyncio.Lock()
+
+		self.users[user_id] = self.users.get(user_id, 0) + 1
+
+		try:
+			async with lock:
+				yield
+		finally:
+			self.users[user_id] -= 1
+
+			if not self.users[user_id]:
+				del self.users[user_id], self.locks[user_id]
@@ -0,0 +1,193 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+import asyncio
+import bisect
+import time
+
+# Process wide counters and latency histograms, exported in the Prometheus text format on a local port. Everything is a
+# no-op until enable() is called, call sites either check metrics.enabled or get back a shared do-nothing timer
+
+_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class _Histogram:
+
+	__slots__ = ("counts", "sum", "count")
+
+	def __init__(self):
+		self.counts = [0] * (_buckets.__len__() + 1) # Last one is +Inf
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value: float):
+		self.counts[bisect.bisect_left(_buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+class _Timer:
+
+	__slots__ = ("metrics", "name", "labels", "started")
+
+	def __init__(self, metrics: "Metrics", name: str, labels: Labels):
+		self.metrics = metrics
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.started = time.perf_counter()
+
+	def __exit__(self, *_):
+		self.metrics._observe(self.name, self.labels, time.perf_counter() - self.started)
+
+class _NullTimer:
+
+	__slots__ = ()
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *_):
+		pass
+
+_null_timer = _NullTimer()
+
+class _RateLimitLog(logging.Handler): # discord.py only reports the waits it does on 429s through its logger
+
+	def __init__(self, metrics: "Metrics"):
+		super().__init__(logging.WARNING)
+		self.metrics = metrics
+
+	def emit(self, record: logging.LogRecord):
+		if "rate limit" in record.getMessage().lower():
+			self.metrics.inc("discord_rate_limit_waits_total")
+
+class Metrics:
+
+	def __init__(self):
+		self.enabled = False
+		self.counters: Dict[str, Dict[Labels, float]] = {}
+		self.histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+		self.gauges: Dict[str, Callable[[], float]] = {} # Read when exported
+		self.started = time.time()
+		self._server: Optional[asyncio.AbstractServer] = None
+
+	def enable(self):
+		if not self.enabled:
+			self.enabled = True
+			logging.getLogger("discord.http").addHandler(_RateLimitLog(self))
+
+	def inc(self, name: str, value: float = 1, **labels: str):
+		if self.enabled:
+			series = self.counters.setdefault(name, {})
+			key = tuple(sorted(labels.items()))
+			series[key] = series.get(key, 0) + value
+
+	def _observe(self, name: str, labels: Labels, value: float):
+		series = self.histograms.setdefault(name, {})
+		histogram = series.get(labels)
+
+		if histogram is None:
+			histogram = series[labels] = _Histogram()
+
+		histogram.observe(value)
+
+	def observe(self, name: str, value: float, **labels: str):
+		if self.enabled:
+			self._observe(name, tuple(sorted(labels.items())), value)
+
+	def timer(self, name: str, **labels: str):
+		if not self.enabled:
+			return _null_timer
+
+		return _Timer(self, name, tuple(sorted(labels.items())))
+
+	def gauge(self, name: str, read: Callable[[], float]):
+		self.gauges[name] = read
+
+	@staticmethod
+	def _labels(labels: Labels, extra: Labels = ()) -> str:
+		labels = labels + extra
+
+		if not labels.__len__():
+			return ""
+
+		return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+	def export(self) -> str:
+		lines: List[str] = []
+
+		for name, series in sorted(self.counters.items()):
+			lines.append(f"# TYPE equalbot_{name} counter")
+			lines.extend(f"equalbot_{name}{self._labels(labels)} {value:g}" for labels, value in sorted(series.items()))
+
+		for name, series in sorted(self.histograms.items()):
+			lines.append(f"# TYPE equalbot_{name} histogram")
+
+			for labels, histogram in sorted(series.items(), key = lambda item: item[0]):
+				cumulative = 0
+
+				for bound, count in zip(_buckets + ("+Inf",), histogram.counts):
+					cumulative += count
+					lines.append(f"equalbot_{name}_bucket{self._labels(labels, (('le', str(bound)),))} {cumulative}")
+
+				lines.append(f"equalbot_{name}_sum{self._labels(labels)} {histogram.sum:g}")
+				lines.append(f"equalbot_{name}_count{self._labels(labels)} {histogram.count}")
+
+		for name, read in sorted(self.gauges.items()):
+			lines.append(f"# TYPE equalbot_{name} gauge")
+			lines.append(f"equalbot_{name} {read():g}")
+
+		lines.append("# TYPE equalbot_uptime_seconds gauge")
+		lines.append(f"equalbot_uptime_seconds {time.time() - self.started:g}")
+
+		return "\n".join(lines) + "\n"
+
+	def summary(self) -> str: # Short human readable version for the admin DM
+		lines: List[str] = []
+
+		for name, series in sorted(self.histograms.items()):
+			for labels, histogram in sorted(series.items(), key = lambda item: item[0]):
+				mean = histogram.sum / histogram.count * 1000 if histogram.count else 0
+				lines.append(f"{name}{self._labels(labels)}: {histogram.count} at {mean:.2f}ms mean")
+
+		for name, series in sorted(self.counters.items()):
+			for labels, value in sorted(series.items()):
+				lines.append(f"{name}{self._labels(labels)}: {value:g}")
+
+		for name, read in sorted(self.gauges.items()):
+			lines.append(f"{name}: {read():g}")
+
+		return "\n".join(lines) or "Nothing recorded yet"
+
+	async def _respond(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			request = await reader.readline()
+
+			while (await reader.readline()) not in (b"\r\n", b"\n", b""): # Skip headers
+				pass
+
+			if request.split(b" ")[1:2] == [b"/metrics"]:
+				status, body = "200 OK", self.export().encode()
+			else:
+				status, body = "404 Not Found", b"Not found, try /metrics\n"
+
+			writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {body.__len__()}\r\nConnection: close\r\n\r\n".encode() + body)
+			await writer.drain()
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def serve(self, host: str, port: int):
+		if self._server is None:
+			self._server = await asyncio.start_server(self._respond, host, port)
+			print(f"\tServing metrics on http://{host}:{port}/metrics")
+
+	async def close(self):
+		if self._server is not None:
+			self._server.close()
+			await self._server.wait_closed()
+			self._server = None
+
+metrics = Metrics()
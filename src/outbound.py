@@ -0,0 +1,210 @@
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from metrics import metrics
+import datetime
+import asyncio
+import discord
+import heapq
+import time
+
+# Moderation and housekeeping calls are queued here instead of being awaited by the event handlers. The most urgent ready
+# action always goes first, each bucket (roughly a Discord rate limit bucket) is spaced out by a minimum interval, and
+# actions queued under the same key are coalesced so only the newest runs. Deletes are gathered per channel and sent as
+# bulk deletes when the messages are young enough. discord.py still handles any 429s underneath
+
+PRIORITY_MODERATION = 0 # Deleting rejected messages
+PRIORITY_MEMBER = 1 # Reactions, roles and nicknames
+PRIORITY_LEADERBOARD = 9 # Lowest, always coalesced
+
+_bulk_delete_max_age = datetime.timedelta(days = 14, minutes = -5) # Discord refuses bulk deletes past 14 days, leave some slack
+_bulk_delete_max_count = 100
+
+class _Action:
+
+	__slots__ = ("bucket", "key", "run", "waiters")
+
+	def __init__(self, bucket: Hashable, key: Optional[Hashable], run: Callable[[], Awaitable[None]]):
+		self.bucket = bucket
+		self.key = key
+		self.run = run
+		self.waiters: List[asyncio.Future] = [] # Everyone who queued under this key since it was last run
+
+class OutboundScheduler:
+
+	def __init__(self, bucket_interval: float = 0.25, concurrency: int = 4):
+		self.bucket_interval = bucket_interval
+		self.concurrency = max(1, concurrency)
+
+		self.queue: List[Tuple[int, int, _Action]] = [] # Heap of (priority, order queued, action)
+		self.keyed: Dict[Hashable, _Action] = {}
+		self.bucket_ready: Dict[Hashable, float] = {} # When each bucket may be used next
+		self.deletes: Dict[int, Dict[int, discord.Message]] = {} # Pending deletes per channel
+
+		self.order = 0
+		self.in_flight = 0
+		self.sent = 0
+		self.throttled = 0 # Times the most urgent action had to wait on its bucket
+
+		self._wakeup: Optional[asyncio.Event] = None
+		self._task: Optional[asyncio.Task] = None
+		self._running: List[asyncio.Task] = []
+
+	def submit(self, bucket: Hashable, priority: int, run: Callable[[], Awaitable[None]], key: Optional[Hashable] = None) -> asyncio.Future:
+		self.start()
+		future = asyncio.get_running_loop().create_future()
+
+		if key is not None and key in self.keyed: # Newest wins, whoever waited on the older one is told when it runs
+			action = self.keyed[key]
+			action.run = run
+			action.waiters.append(future)
+			return future
+
+		action = _Action(bucket, key, run)
+		action.waiters.append(future)
+
+		if key is not None:
+			self.keyed[key] = action
+
+		heapq.heappush(self.queue, (priority, self.order, action))
+		self.order += 1
+		self._wake()
+
+		return future
+
+	async def call(self, bucket: Hashable, priority: int, run: Callable[[], Awaitable[None]], key: Optional[Hashable] = None):
+		await self.submit(bucket, priority, run, key)
+
+	def delete(self, message: discord.Message):
+		channel_id = message.channel.id
+		self.deletes.setdefault(channel_id, {})[message.id] = message
+		self.submit(("delete", channel_id), PRIORITY_MODERATION, lambda: self._flush_deletes(channel_id), ("delete", channel_id))
+
+	async def _flush_deletes(self, channel_id: int):
+		messages = list(self.deletes.pop(channel_id, {}).values())
+		cutoff = datetime.datetime.now(datetime.timezone.utc) - _bulk_delete_max_age
+
+		young = [message for message in messages if discord.utils.snowflake_time(message.id) > cutoff]
+		old = [message for message in messages if discord.utils.snowflake_time(message.id) <= cutoff]
+
+		for start in range(0, young.__len__(), _bulk_delete_max_count):
+			batch = young[start:start + _bulk_delete_max_count]
+
+			if batch.__len__() == 1:
+				old.append(batch[0])
+				continue
+
+			try:
+				await batch[0].channel.delete_messages(batch)
+				self.sent += 1
+				metrics.inc("messages_deleted_total", batch.__len__(), method = "bulk")
+			except discord.HTTPException as error: # One was already gone or too old, fall back to deleting them one by one
+				if not isinstance(error, discord.NotFound):
+					print(f"Unable to bulk delete {batch.__len__()} messages in channel {channel_id}, deleting them one by one: {error}")
+
+				old.extend(batch)
+
+		for message in old:
+			try:
+				await message.delete()
+				self.sent += 1
+				metrics.inc("messages_deleted_total", method = "single")
+			except discord.NotFound:
+				pass
+			except discord.HTTPException as error: # Keep going, the rest were popped from the queue with it
+				print(f"Unable to delete message {message.id} in channel {channel_id}: {error}")
+
+	def _wake(self):
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	def _next_ready(self, now: float) -> Tuple[Optional[_Action], Optional[float]]:
+		skipped = []
+		action, wait = None, None
+
+		while self.queue.__len__():
+			entry = heapq.heappop(self.queue)
+			ready = self.bucket_ready.get(entry[2].bucket, 0)
+
+			if ready <= now:
+				action = entry[2]
+				break
+
+			if not skipped.__len__():
+				self.throttled += 1
+				metrics.inc("outbound_throttled_total")
+
+			skipped.append(entry)
+			wait = ready - now if wait is None else min(wait, ready - now)
+
+		for entry in skipped:
+			heapq.heappush(self.queue, entry)
+
+		return action, wait
+
+	async def _execute(self, action: _Action):
+		try:
+			await action.run()
+		except Exception as error:
+			print(f"Outbound action on {action.bucket} failed: {error}")
+
+			for future in action.waiters:
+				if not future.done():
+					future.set_exception(error)
+					future.exception() # Marks it retrieved, fire and forget submitters never look
+		else:
+			for future in action.waiters:
+				if not future.done():
+					future.set_result(None)
+		finally:
+			self.in_flight -= 1
+			self._wake()
+
+	async def _run(self):
+		while True:
+			self._wakeup.clear()
+			wait = None
+
+			if self.in_flight < self.concurrency:
+				now = time.monotonic()
+				action, wait = self._next_ready(now)
+
+				if action is not None:
+					if action.key is not None:
+						del self.keyed[action.key] # Anything queued under the key from here on is a new action
+
+					self.bucket_ready[action.bucket] = now + self.bucket_interval
+					self.in_flight += 1
+
+					task = asyncio.ensure_future(self._execute(action))
+					self._running.append(task)
+					task.add_done_callback(self._running.remove)
+					continue
+
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), wait)
+			except asyncio.TimeoutError:
+				pass
+
+	def start(self):
+		if self._task is None:
+			self._wakeup = asyncio.Event()
+			self._task = asyncio.get_running_loop().create_task(self._run())
+
+	def pending(self) -> int:
+		return self.queue.__len__() + self.in_flight
+
+	async def close(self, timeout: float = 10):
+		if self._task is None:
+			return
+
+		deadline = time.monotonic() + timeout
+
+		while self.pending() and time.monotonic() < deadline: # Drain what's queued so nothing is dropped on shutdown
+			await asyncio.sleep(0.05)
+
+		self._task.cancel()
+
+		for task in self._running:
+			task.cancel()
+
+		self._task = None
+		self._wakeup = None
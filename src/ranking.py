@@ -0,0 +1,101 @@
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+from util import POST_COST
+import bisect
+
+# Keeps users ordered by points as they change instead of sorting on every render. Column widths come from counters of
+# how many rows have each width, so the widest is known without rescanning, and each row's text is cached until that
+# user changes or a column's width does. Rows are all padded to the same length, so pages hold a fixed number of ranks
+# and a change near the bottom leaves the text of the top pages alone
+
+MESSAGE_LIMIT = 2000 # Discord's cap on message content
+_page_start, _page_end = "```md\n", "\n```"
+
+class LeaderboardIndex:
+
+	def __init__(self):
+		self.order: List[Tuple[int, int, str]] = [] # (-points, first seen, user id), ascending is the leaderboard
+		self.keys: Dict[str, Tuple[int, int, str]] = {}
+		self.columns: Dict[str, Tuple[str, int, int]] = {} # name, score, post count per user
+		self.rows: Dict[str, str] = {}
+
+		self.widths = (Counter(), Counter(), Counter()) # name, score, posts
+		self.rendered_widths = (0, 0, 0)
+		self.seen = 0
+
+	def reset(self, users: Dict[str, dict]):
+		self.__init__()
+
+		for user_id, user in users.items():
+			self.update(user_id, user)
+
+	def _column_widths(self, columns: Tuple[str, int, int]) -> Tuple[int, int, int]:
+		return columns[0].__len__(), columns[1].__str__().__len__(), columns[2].__str__().__len__()
+
+	def update(self, user_id: str, user: dict):
+		columns = (user["name"], user["points"] - user["posts"] * POST_COST, user["posts"])
+		old_key = self.keys.get(user_id)
+
+		if old_key is not None:
+			if old_key[0] != -user["points"]:
+				del self.order[bisect.bisect_left(self.order, old_key)]
+				key = (-user["points"], old_key[1], user_id)
+				bisect.insort(self.order, key)
+				self.keys[user_id] = key
+
+			for counter, width in zip(self.widths, self._column_widths(self.columns[user_id])):
+				counter[width] -= 1
+
+				if not counter[width]:
+					del counter[width]
+		else:
+			key = (-user["points"], self.seen, user_id)
+			self.seen += 1
+			bisect.insort(self.order, key)
+			self.keys[user_id] = key
+
+		for counter, width in zip(self.widths, self._column_widths(columns)):
+			counter[width] += 1
+
+		self.columns[user_id] = columns
+		self.rows.pop(user_id, None)
+
+	def ranked(self) -> List[str]:
+		return [key[2] for key in self.order]
+
+	def row(self, user_id: str) -> str:
+		row = self.rows.get(user_id)
+
+		if row is None:
+			name, score, posts = self.columns[user_id]
+			name_width, score_width, posts_width = self.rendered_widths
+			row = self.rows[user_id] = f"[ {name:<{name_width}} ][ {score:^{score_width}} ][ {posts:>{posts_width}} ]"
+
+		return row
+
+	def render_rows(self) -> List[str]:
+		widths = tuple(max(counter) if counter.__len__() else 0 for counter in self.widths)
+
+		if widths != self.rendered_widths: # Every row's padding changes
+			self.rendered_widths = widths
+			self.rows.clear()
+
+		return [self.row(key[2]) for key in self.order]
+
+	def render(self) -> str:
+		return _page_start + "\n".join(self.render_rows()) + _page_end
+
+	def render_pages(self, rows_per_page: Optional[int] = None) -> List[str]:
+		rows = self.render_rows()
+
+		if not rows.__len__():
+			return [_page_start + _page_end]
+
+		fits = (MESSAGE_LIMIT - _page_start.__len__() - _page_end.__len__() + 1) // (rows[0].__len__() + 1)
+
+		if rows_per_page is None or rows_per_page > fits:
+			rows_per_page = fits
+
+		rows_per_page = max(1, rows_per_page)
+
+		return [_page_start + "\n".join(rows[start:start + rows_per_page]) + _page_end for start in range(0, rows.__len__(), rows_per_page)]
@@ -0,0 +1,132 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import discord
+import time
+
+# Splits a channel's timeline into snowflake ranges, fetches them concurrently and tallies chaos points per range
+# before merging. Snowflakes grow with time so equal id ranges are equal time ranges. discord.py already waits out
+# rate limits per bucket, the semaphore only bounds how many history pages are in flight at once
+
+_done = None # Queue sentinel, one per consumer
+
+class HistoricalRebuild:
+
+	def __init__(self, channel: discord.TextChannel, classify: Callable[[discord.Message], int],
+			after_id: int, before_id: int, partitions: int = 8, concurrency: int = 4, workers: int = 4,
+			act: Optional[Callable[[discord.Message, int], Awaitable[None]]] = None, progress_interval: float = 5):
+		self.channel = channel
+		self.classify = classify
+		self.after_id = after_id # Exclusive
+		self.before_id = before_id # Exclusive
+		self.partitions = max(1, partitions)
+		self.concurrency = max(1, concurrency)
+		self.workers = max(1, workers)
+		self.act = act # Told about every message with how it was classified, classifying itself has no side effects
+		self.progress_interval = progress_interval
+
+		self.fetched = 0
+		self.processed = 0
+		self.ranges_done = 0
+		self.newest_id = 0
+
+	def ranges(self) -> List[Tuple[int, int]]: # (after, before) pairs, both exclusive, covering (after_id, before_id)
+		span = self.before_id - self.after_id - 1
+
+		if span <= 0:
+			return []
+
+		partitions = min(self.partitions, span)
+		bounds = [self.after_id + 1 + span * i // partitions for i in range(partitions)] + [self.before_id]
+
+		return [(bounds[i] - 1, bounds[i + 1]) for i in range(partitions)]
+
+	async def _produce(self, index: int, after: int, before: int, limiter: asyncio.Semaphore, queue: asyncio.Queue):
+		async with limiter:
+			message: discord.Message
+			async for message in self.channel.history(limit = None, after = discord.Object(id = after), before = discord.Object(id = before)):
+				self.fetched += 1
+				await queue.put((index, message))
+
+		self.ranges_done += 1
+
+	async def _consume(self, queue: asyncio.Queue, tallies: List[Dict[str, dict]]):
+		while True:
+			item = await queue.get()
+
+			if item is _done:
+				return
+
+			index, message = item
+			tally = tallies[index]
+
+			author_id = str(message.author.id)
+			if author_id not in tally:
+				tally[author_id] = {"name": message.author.name, "points": 0, "posts": 0}
+
+			if message.id > self.newest_id:
+				self.newest_id = message.id
+
+			check = self.classify(message)
+			if check == 1:
+				tally[author_id]["points"] += 1
+
+			elif check == -1:
+				tally[author_id]["points"] -= 1
+
+			if self.act is not None:
+				await self.act(message, check)
+
+			self.processed += 1
+
+	async def _report(self, started: float, total_ranges: int):
+		while True:
+			await asyncio.sleep(self.progress_interval)
+			self.print_progress(started, total_ranges)
+
+	def print_progress(self, started: float, total_ranges: int):
+		elapsed = time.monotonic() - started
+		rate = self.processed / elapsed if elapsed > 0 else 0
+		print(f"\t\t{self.processed} message{'' if self.processed == 1 else 's'} processed, {self.ranges_done}/{total_ranges} ranges fetched, {rate:.1f} messages/second")
+
+	@staticmethod
+	def merge(tallies: List[Dict[str, dict]]) -> Dict[str, dict]:
+		merged: Dict[str, dict] = {}
+
+		for tally in tallies:
+			for user_id, user_data in tally.items():
+				if user_id in merged:
+					merged[user_id]["points"] += user_data["points"]
+				else:
+					merged[user_id] = user_data
+
+		return merged
+
+	async def run(self) -> Dict[str, dict]:
+		ranges = self.ranges()
+		tallies: List[Dict[str, dict]] = [{} for _ in ranges]
+
+		queue = asyncio.Queue(maxsize = 1000) # Backpressure so fast fetches don't pile up unclassified messages
+		limiter = asyncio.Semaphore(self.concurrency)
+		started = time.monotonic()
+
+		producers = [asyncio.ensure_future(self._produce(index, after, before, limiter, queue)) for index, (after, before) in enumerate(ranges)]
+		consumers = [asyncio.ensure_future(self._consume(queue, tallies)) for _ in range(self.workers)]
+		reporter = asyncio.ensure_future(self._report(started, ranges.__len__()))
+
+		async def produce_all():
+			await asyncio.gather(*producers)
+
+			for _ in consumers:
+				await queue.put(_done)
+
+		try:
+			await asyncio.gather(produce_all(), *consumers) # A failing consumer fails the whole run rather than stalling producers on a full queue
+		finally:
+			for task in producers + consumers:
+				task.cancel()
+
+			reporter.cancel()
+
+		self.print_progress(started, ranges.__len__())
+
+		return self.merge(tallies)
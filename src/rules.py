@@ -0,0 +1,94 @@
+from typing import Dict, FrozenSet, Tuple
+import discord
+
+# What counts as a good message in the Equal channel, written as data in config/bot.json under "Message Rules" and
+# compiled into a lookup table of allowed content for every day of the year plus a bitmask of forbidden message features.
+# Classifying is then a mask test and a set lookup, with no side effects so the same rules serve live and historical
+# messages. Whatever is done about a message (deleting it, clearing its reactions) is up to the caller
+
+REPLY = 1 << 0
+ATTACHMENT = 1 << 1
+STICKER = 1 << 2
+EMBED = 1 << 3
+
+_features = {"reply": REPLY, "attachment": ATTACHMENT, "sticker": STICKER, "embed": EMBED}
+
+_days_in_month = (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+DEFAULT_RULES = {
+	"Allowed": ["Equal"],
+	"Dated": [{"Content": "Equal 🎄", "Month": 12, "Day": 25}], # Christmas
+	"Birthday": ["Equal 🎂"], # Allowed on any day someone has set as their birthday
+	"Forbidden Features": ["reply", "attachment"],
+	"Clear Reactions": True
+}
+
+def features_of(message: discord.Message) -> int:
+	features = 0
+
+	if message.reference is not None and not message.is_system(): # System messages reference what they're about
+		features |= REPLY
+
+	if message.attachments.__len__():
+		features |= ATTACHMENT
+
+	if message.stickers.__len__():
+		features |= STICKER
+
+	if message.embeds.__len__():
+		features |= EMBED
+
+	return features
+
+class MessageRules:
+
+	def __init__(self, allowed: Dict[Tuple[int, int], Tuple[FrozenSet[str], FrozenSet[str]]], forbidden: int, clear_reactions: bool):
+		self.allowed = allowed # (month, day) -> (allowed content, allowed content when it's someone's birthday)
+		self.forbidden = forbidden
+		self.clear_reactions = clear_reactions
+
+	@classmethod
+	def compile(cls, rules: dict) -> "MessageRules":
+		if not isinstance(rules, dict):
+			raise ValueError("Invalid message rules, must be a dictionary")
+
+		everyday = set(rules.get("Allowed", []))
+		birthday = set(rules.get("Birthday", []))
+		dated: Dict[Tuple[int, int], set] = {}
+
+		for variant in rules.get("Dated", []):
+			if not isinstance(variant, dict) or not isinstance(variant.get("Content"), str):
+				raise ValueError(f"Invalid dated rule \"{variant}\", must be a dictionary with a \"Content\" string")
+
+			month, day = variant.get("Month", 13), variant.get("Day", 32)
+
+			if not isinstance(month, int) or month < 1 or month > 12:
+				raise ValueError(f"Invalid month \"{month}\" for \"{variant.get('Content')}\", must be 1 <= month <= 12")
+
+			if not isinstance(day, int) or day < 1 or day > _days_in_month[month - 1]:
+				raise ValueError(f"Invalid day \"{day}\" for \"{variant.get('Content')}\", must be 1 <= day <= {_days_in_month[month - 1]}")
+
+			dated.setdefault((month, day), set()).add(variant["Content"])
+
+		forbidden = 0
+
+		for feature in rules.get("Forbidden Features", []):
+			if feature not in _features:
+				raise ValueError(f"Invalid forbidden feature \"{feature}\", must be one of {', '.join(_features)}")
+
+			forbidden |= _features[feature]
+
+		allowed = {}
+
+		for month, days in enumerate(_days_in_month, 1):
+			for day in range(1, days + 1):
+				on_day = frozenset(everyday | dated.get((month, day), set()))
+				allowed[(month, day)] = (on_day, on_day | birthday)
+
+		return cls(allowed, forbidden, rules.get("Clear Reactions", True))
+
+	def classify(self, content: str, features: int, month: int, day: int, birthday: bool) -> int: # 1 good, -1 bad
+		if features & self.forbidden:
+			return -1
+
+		return 1 if content in self.allowed[(month, day)][birthday] else -1
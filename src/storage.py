@@ -0,0 +1,313 @@
+from typing import Dict, Iterable, List, Tuple
+from abc import ABC, abstractmethod
+from util import _read_json, _write_json_atomic, _write_atomic
+from metrics import metrics
+import threading
+import sqlite3
+import json
+import os
+
+# Where chaos points, chaos posts and birthdays live on disk. The ledger and the birthday code keep their state in memory
+# and only hand storage change records ({"seq", "op", "id", ...}, see ChaosLedger.apply) and whole snapshots. Snapshots
+# hold each user's name, points and post count, the text of chaos posts only ever arrives in "post" records
+
+class Storage(ABC):
+
+	compacts = False # Whether appended records pile up until the ledger folds them into a snapshot
+
+	@abstractmethod
+	def chaos_exists(self) -> bool:
+		pass
+
+	@abstractmethod
+	def load_chaos(self) -> Tuple[Dict[str, dict], int, int, List[dict]]: # users, seq, checkpoint, records to replay on top
+		pass
+
+	@abstractmethod
+	def append_chaos(self, records: List[dict]): # May be handed records a snapshot already covers, those must be skipped
+		pass
+
+	@abstractmethod
+	def write_chaos_snapshot(self, users: Dict[str, dict], seq: int, checkpoint: int):
+		pass
+
+	def merge_chaos(self, deltas: Dict[str, dict], checkpoint: int): # {user id: {"name", "points"}} to add, only called on storages that don't compact
+		raise NotImplementedError
+
+	@abstractmethod
+	def write_checkpoint(self, checkpoint: int): # Storages that compact get it with every snapshot as well
+		pass
+
+	@abstractmethod
+	def load_birthdays(self) -> Dict[str, dict]:
+		pass
+
+	@abstractmethod
+	def set_birthdays(self, changes: Dict[str, dict]): # {user id: {"month", "day"}} for everyone changed since the last call
+		pass
+
+	def close(self):
+		pass
+
+# chaos.json is a snapshot ({"seq": <last journal record folded in>, "checkpoint": <message id>, "users": {...}}) and
+# chaos.journal holds one JSON record per line for every change made since. Records carry increasing sequence numbers so
+# replaying a journal that was already folded into the snapshot (crash between the rename and the truncate) is a no-op.
+# Chaos post text is appended to chaos_posts.jsonl ({"id", "post"} per line) and never read back outside of migrating
+
+class JsonStorage(Storage):
+
+	compacts = True
+
+	def __init__(self, data_path: str):
+		self.chaos_path = os.path.join(data_path, "chaos.json")
+		self.journal_path = os.path.join(data_path, "chaos.journal")
+		self.posts_path = os.path.join(data_path, "chaos_posts.jsonl")
+		self.birthdays_path = os.path.join(data_path, "birthdays.json")
+
+	def chaos_exists(self) -> bool:
+		return os.path.isfile(self.chaos_path)
+
+	def load_chaos(self) -> Tuple[Dict[str, dict], int, int, List[dict]]:
+		users, seq, checkpoint, records = {}, 0, 0, []
+
+		if os.path.isfile(self.chaos_path):
+			snapshot = _read_json(self.chaos_path)
+
+			if "users" in snapshot and "seq" in snapshot:
+				users, seq, checkpoint = snapshot["users"], snapshot["seq"], snapshot.get("checkpoint", 0)
+			else: # Pre-journal chaos.json was just the users
+				users = snapshot
+
+		if os.path.isfile(self.journal_path):
+			with open(self.journal_path, "r") as journal_file:
+				for line in journal_file:
+					try:
+						record = json.loads(line)
+					except ValueError: # Torn final line from a crash mid-append, everything before it is intact
+						print(f"Ignoring partial record at the end of \"{self.journal_path}\"")
+						break
+
+					if record["seq"] > seq: # Otherwise already in the snapshot
+						records.append(record)
+
+		self._archive_legacy_posts(users, records)
+
+		return users, seq, checkpoint, records
+
+	def _archive_legacy_posts(self, users: Dict[str, dict], records: List[dict]): # Snapshots and journals from before posts were only counted
+		posts = []
+
+		for user_id, user in users.items():
+			if "chaos_posts" in user:
+				posts.extend((user_id, post) for post in user["chaos_posts"])
+				user["posts"] = user.pop("chaos_posts").__len__()
+
+		if os.path.isfile(self.posts_path): # Written on an earlier start, or posts made since were appended with their records
+			return
+
+		posts.extend((record["id"], record["post"]) for record in records if record["op"] == "post")
+
+		if posts.__len__():
+			_write_atomic(self.posts_path, lambda posts_file: posts_file.write("".join(json.dumps({"id": user_id, "post": post}) + "\n" for user_id, post in posts)))
+
+	def load_posts(self) -> List[Tuple[str, str]]: # (user id, post) oldest first
+		posts = []
+
+		if os.path.isfile(self.posts_path):
+			with open(self.posts_path, "r") as posts_file:
+				for line in posts_file:
+					try:
+						post = json.loads(line)
+					except ValueError: # Torn final line
+						break
+
+					posts.append((post["id"], post["post"]))
+
+		return posts
+
+	def append_chaos(self, records: List[dict]):
+		posts = "".join(json.dumps({"id": record["id"], "post": record["post"]}) + "\n" for record in records if record["op"] == "post")
+
+		if posts.__len__(): # Before the journal, so the text is kept by the time the snapshot only counts it
+			with open(self.posts_path, "a") as posts_file:
+				posts_file.write(posts)
+				posts_file.flush()
+				os.fsync(posts_file.fileno())
+
+		lines = "".join(json.dumps(record) + "\n" for record in records)
+
+		with open(self.journal_path, "a") as journal_file:
+			journal_file.write(lines)
+			journal_file.flush()
+			os.fsync(journal_file.fileno())
+
+		if metrics.enabled:
+			metrics.inc("journal_appends_total")
+			metrics.inc("journal_append_bytes_total", lines.encode().__len__())
+
+	def write_chaos_snapshot(self, users: Dict[str, dict], seq: int, checkpoint: int):
+		_write_json_atomic(self.chaos_path, {"seq": seq, "checkpoint": checkpoint, "users": users})
+
+		with open(self.journal_path, "w"): # Truncate, the ledger only snapshots after everything it appended
+			pass
+
+	def write_checkpoint(self, checkpoint: int):
+		if os.path.isfile(self.chaos_path):
+			snapshot = _read_json(self.chaos_path)
+
+			if "users" in snapshot and "seq" in snapshot and checkpoint > snapshot.get("checkpoint", 0):
+				snapshot["checkpoint"] = checkpoint
+				_write_json_atomic(self.chaos_path, snapshot)
+
+	def load_birthdays(self) -> Dict[str, dict]:
+		if not os.path.isfile(self.birthdays_path):
+			return {}
+
+		return _read_json(self.birthdays_path)
+
+	def set_birthdays(self, changes: Dict[str, dict]):
+		birthday_data = self.load_birthdays()
+		birthday_data.update(changes)
+		_write_json_atomic(self.birthdays_path, birthday_data)
+
+# Every record is applied as it's appended so there's nothing to compact, and an incremental search's deltas only update
+# the users it found. Post counts are worked out from the posts table on load, a snapshot (a full rebuild or migrating)
+# rewrites users and leaves posts alone. Statements are module constants so sqlite3's statement cache keeps them prepared
+
+_schema = """
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, name TEXT NOT NULL, points INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS users_points ON users (points DESC);
+CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, post TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS posts_user ON posts (user_id);
+CREATE TABLE IF NOT EXISTS birthdays (user_id TEXT PRIMARY KEY, month INTEGER NOT NULL, day INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS birthdays_day ON birthdays (month, day);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+_add_user = "INSERT INTO users (id, name, points) VALUES (?, ?, 0) ON CONFLICT (id) DO NOTHING"
+_increase = "UPDATE users SET points = points + 1 WHERE id = ?"
+_decrease = "UPDATE users SET points = MAX(points - 1, 0) WHERE id = ?"
+_add_points = "UPDATE users SET points = points + ? WHERE id = ?"
+_add_post = "INSERT INTO posts (user_id, post) VALUES (?, ?)"
+_set_meta = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+_set_meta_max = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)"
+_set_birthday = "INSERT INTO birthdays (user_id, month, day) VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET month = excluded.month, day = excluded.day"
+
+class SqliteStorage(Storage):
+
+	def __init__(self, path: str):
+		self.path = path
+		self.connection = sqlite3.connect(path, check_same_thread = False) # Used from executor threads, always under self.lock
+		self.lock = threading.Lock() # The ledger and the birthday index flush on their own, possibly at the same time
+		self.connection.execute("PRAGMA journal_mode = WAL")
+		self.connection.execute("PRAGMA synchronous = NORMAL")
+		self.connection.executescript(_schema)
+		self.connection.commit()
+
+	def _meta(self, key: str) -> int:
+		row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+		return 0 if row is None else row[0]
+
+	def chaos_exists(self) -> bool:
+		with self.lock:
+			return self.connection.execute("SELECT 1 FROM meta WHERE key = 'seq'").fetchone() is not None
+
+	def load_chaos(self) -> Tuple[Dict[str, dict], int, int, List[dict]]:
+		with self.lock:
+			users = {user_id: {"name": name, "points": points, "posts": 0} for user_id, name, points in self.connection.execute("SELECT id, name, points FROM users")}
+
+			for user_id, posts in self.connection.execute("SELECT user_id, COUNT(*) FROM posts GROUP BY user_id"):
+				if user_id in users:
+					users[user_id]["posts"] = posts
+
+			return users, self._meta("seq"), self._meta("checkpoint"), []
+
+	def append_chaos(self, records: List[dict]):
+		with self.lock, self.connection:
+			seq = self._meta("seq")
+			records = [record for record in records if record["seq"] > seq] # Anything older is already in a snapshot
+
+			for record in records:
+				user_id = record["id"]
+				self.connection.execute(_add_user, (user_id, record.get("name", user_id)))
+
+				if record["op"] == "inc":
+					self.connection.execute(_increase, (user_id,))
+				elif record["op"] == "dec":
+					self.connection.execute(_decrease, (user_id,))
+				elif record["op"] == "post":
+					self.connection.execute(_add_post, (user_id, record["post"]))
+
+				if "msg" in record:
+					self.connection.execute(_set_meta_max, ("checkpoint", record["msg"]))
+
+			if records.__len__():
+				self.connection.execute(_set_meta, ("seq", records[-1]["seq"]))
+
+		if metrics.enabled:
+			metrics.inc("sqlite_chaos_records_total", records.__len__())
+
+	def _write_users(self, users: Dict[str, dict], seq: int, checkpoint: int): # Only with self.lock held, inside a transaction
+		self.connection.execute("DELETE FROM users")
+		self.connection.executemany("INSERT INTO users (id, name, points) VALUES (?, ?, ?)", ((user_id, user["name"], user["points"]) for user_id, user in users.items()))
+		self.connection.execute(_set_meta, ("seq", seq))
+		self.connection.execute(_set_meta, ("checkpoint", checkpoint))
+
+	def write_chaos_snapshot(self, users: Dict[str, dict], seq: int, checkpoint: int):
+		with self.lock, self.connection:
+			self._write_users(users, seq, checkpoint)
+
+	def merge_chaos(self, deltas: Dict[str, dict], checkpoint: int):
+		with self.lock, self.connection:
+			self.connection.executemany(_add_user, ((user_id, delta["name"]) for user_id, delta in deltas.items()))
+			self.connection.executemany(_add_points, ((delta["points"], user_id) for user_id, delta in deltas.items()))
+			self.connection.execute(_set_meta_max, ("checkpoint", checkpoint))
+
+	def import_chaos(self, users: Dict[str, dict], seq: int, checkpoint: int, posts: Iterable[Tuple[str, str]]): # Migrating, in one transaction so it's never half done
+		with self.lock, self.connection:
+			self.connection.execute("DELETE FROM posts")
+			self.connection.executemany(_add_post, posts)
+			self._write_users(users, seq, checkpoint)
+
+	def write_checkpoint(self, checkpoint: int):
+		with self.lock, self.connection:
+			self.connection.execute(_set_meta_max, ("checkpoint", checkpoint))
+
+	def load_birthdays(self) -> Dict[str, dict]:
+		with self.lock:
+			return {user_id: {"month": month, "day": day} for user_id, month, day in self.connection.execute("SELECT user_id, month, day FROM birthdays")}
+
+	def set_birthdays(self, changes: Dict[str, dict]):
+		with self.lock, self.connection:
+			self.connection.executemany(_set_birthday, ((user_id, birthday["month"], birthday["day"]) for user_id, birthday in changes.items()))
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
+
+def migrate_json(source: JsonStorage, destination: SqliteStorage): # One shot copy, the JSON files are left where they are
+	from ledger import ChaosLedger # Replays the journal tail exactly like a normal start would
+
+	ledger = ChaosLedger(source)
+	destination.import_chaos(ledger.users, ledger.seq, ledger.checkpoint, source.load_posts())
+
+	destination.set_birthdays({user_id: {"month": int(birthday["month"]), "day": int(birthday["day"])} for user_id, birthday in source.load_birthdays().items()})
+
+	print(f"Migrated {ledger.users.__len__()} chaos user{'' if ledger.users.__len__() == 1 else 's'} and their birthdays from JSON")
+
+def open_storage(backend: str, data_path: str) -> Storage:
+	if backend == "json":
+		return JsonStorage(data_path)
+
+	if backend == "sqlite":
+		database_path = os.path.join(data_path, "equalbot.db")
+		storage = SqliteStorage(database_path)
+
+		source = JsonStorage(data_path)
+
+		if not storage.chaos_exists() and (source.chaos_exists() or source.load_birthdays().__len__()): # First run on SQLite
+			migrate_json(source, storage)
+
+		return storage
+
+	raise ValueError(f"Invalid storage backend \"{backend}\", must be \"json\" or \"sqlite\"")
@@ -0,0 +1,223 @@
+from typing import List, Optional, Union
+from ledger import ChaosLedger
+from storage import open_storage
+from birthdays import BirthdayIndex
+from rebuild import HistoricalRebuild
+from leaderboard import LeaderboardPublisher
+from locks import UserLocks
+from outbound import OutboundScheduler, PRIORITY_MEMBER
+from rules import MessageRules, DEFAULT_RULES, features_of
+from expiring import ExpiringDict
+import datetime
+import asyncio
+import discord
+import os
+
+_retry_max_delay = 15 * 60 # Seconds, failed historical searches back off to retrying this often
+
+# Everything one guild owns: its channels and role, its chaos ledger and birthdays in their own storage, its leaderboard,
+# its message rules and its per-user locks. Guilds share the client, the outbound scheduler and nothing else, so one
+# guild's rebuild or burst of messages never reads or writes another's data
+
+class GuildTenant:
+
+	def __init__(self, client: discord.Client, guild_id: Optional[int], guild_config: dict, data_path: str, outbound: OutboundScheduler):
+		self.client = client
+		self.guild_id = guild_id # None until worked out from the Equal channel, for configs from before guilds had their own section
+		self.data_path = data_path
+		self.outbound = outbound
+
+		if not os.path.isdir(data_path):
+			os.makedirs(data_path, 0o744, True)
+
+		self.leaderboard_channel_id = guild_config.get("Leaderboard Channel ID", None)
+		self.equal_channel_id = guild_config.get("Equal Channel ID", None)
+		self.equal_role_id = guild_config.get("Equal Role ID", None)
+		self.chaos_channel_id = guild_config.get("Chaos Channel ID", None)
+		self.historical_purge = guild_config.get("Historical Purge", False)
+		self.historical_search_mode = guild_config.get("Historical Search Mode", "incremental") # "incremental" or "full"
+		self.historical_search_partitions = guild_config.get("Historical Search Partitions", 8)
+		self.historical_search_concurrency = guild_config.get("Historical Search Concurrency", 4)
+		self.historical_search_workers = guild_config.get("Historical Search Workers", 4)
+		self.historical_search_retry_delay = guild_config.get("Historical Search Retry Delay (in seconds)", 30) # Doubles after each failure
+
+		self.storage = open_storage(guild_config.get("Storage Backend", "json"), data_path) # "json" or "sqlite"
+
+		self.ledger = ChaosLedger(self.storage,
+			guild_config.get("Chaos Flush Interval (in seconds)", 30),
+			guild_config.get("Chaos Flush Threshold", 100),
+			guild_config.get("Chaos Journal Compaction Threshold", 1000))
+		self.ledger.hold() # Until catch_up has searched past the loaded checkpoint, live messages mustn't move it
+		self.searching = False
+		self.retry_task: Optional[asyncio.Task] = None
+
+		self.leaderboard_rows_per_page = guild_config.get("Leaderboard Rows Per Page", None) # None fits as many as a message allows
+		self.leaderboard = LeaderboardPublisher(client, self.leaderboard_channel_id, os.path.join(data_path, "leaderboard.json"),
+			self.generate_leaderboard_pages, guild_config.get("Leaderboard Update Window (in seconds)", 5), outbound)
+
+		self.birthdays = BirthdayIndex(self.storage, guild_config.get("Birthday Flush Interval (in seconds)", 30))
+		self.rules = MessageRules.compile(guild_config.get("Message Rules", DEFAULT_RULES))
+
+		self.posts_to_confirm = ExpiringDict(guild_config.get("Chaos Post Confirm Timeout (in seconds)", 600)) # user id -> post waiting on chaos confirm
+		self.user_locks = UserLocks() # Serializes each user's events, ledger writes themselves never await so they can't interleave
+
+	def resolve(self) -> bool: # Whether the guild id is known
+		if self.guild_id is None:
+			equal_channel = self.client.get_channel(self.equal_channel_id)
+
+			if equal_channel is not None:
+				self.guild_id = equal_channel.guild.id
+
+		return self.guild_id is not None
+
+	def start(self): # Called first thing on every ready, a reconnect may have missed messages too
+		self.ledger.hold()
+		self.ledger.start()
+		self.birthdays.start()
+
+	async def increase_chaos(self, user_id: Union[int, str], user_name: str, message_id: int = None):
+		self.ledger.increase(user_id, user_name, message_id)
+		await self.update_leaderboard()
+
+	async def decrease_chaos(self, user_id: Union[int, str], user_name: str):
+		self.ledger.decrease(user_id, user_name)
+		await self.update_leaderboard()
+
+	async def generate_leaderboard_pages(self) -> List[str]:
+		return self.ledger.ranking.render_pages(self.leaderboard_rows_per_page)
+
+	async def update_leaderboard(self):
+		self.leaderboard.request()
+
+	def get_balance(self, user_id: int) -> int:
+		return self.ledger.balance(user_id)
+
+	async def catch_up(self, should_run_historical_search: bool, reconnected: bool = False): # Run per guild on ready, guilds don't wait on each other
+		if self.searching or (self.retry_task is not None and not self.retry_task.done()): # Reconnected while a search from the last ready is still going or waiting to retry, it releases the ledger when done
+			return
+
+		if not self.ledger.exists() or not self.ledger.checkpoint: # Nothing to resume from
+			await self.search_or_retry(True)
+
+		elif self.historical_search_mode == "full":
+			if should_run_historical_search:
+				await self.search_or_retry(True)
+			elif reconnected: # Whatever was sent while the connection was down never arrived, and the heartbeat can't say how long that was
+				await self.search_or_retry(False)
+			else:
+				self.ledger.release() # Nothing was missed
+
+		else:
+			await self.search_or_retry(False)
+
+		await self.leaderboard.publish()
+
+	async def search_or_retry(self, full: bool):
+		try:
+			await self.historical_search(full)
+		except Exception:
+			self.retry_task = asyncio.ensure_future(self.retry_search(full))
+			raise
+
+	async def retry_search(self, full: bool): # The ledger stays held meanwhile, live messages are still counted in memory
+		delay = self.historical_search_retry_delay
+
+		while True:
+			print(f"\tRetrying historical search in guild {self.guild_id} in {delay} second{'' if delay == 1 else 's'}")
+			await asyncio.sleep(delay)
+
+			try:
+				await self.historical_search(full)
+			except Exception as error:
+				print(f"\tHistorical search in guild {self.guild_id} failed again: {error}")
+				delay = min(delay * 2, _retry_max_delay)
+			else:
+				await self.leaderboard.publish()
+				return
+
+	async def historical_search(self, full: bool):
+		equal_channel: discord.TextChannel = self.client.get_channel(self.equal_channel_id)
+
+		if equal_channel is None:
+			print(f"Unable to run historical search for guild {self.guild_id}, couldn't find channel with id \"{self.equal_channel_id}\"")
+			self.ledger.release()
+			return
+
+		if full:
+			print(f"\tRunning full historical search to calculate chaos points in guild {self.guild_id}")
+			after_id = equal_channel.id # Channel ids are snowflakes from its creation, every message in it is newer
+		else:
+			print(f"\tRunning incremental historical search in guild {self.guild_id} after message {self.ledger.checkpoint}")
+			after_id = self.ledger.checkpoint
+
+		self.ledger.hold() # Usually already held since start
+
+		# Live messages from the oldest one seen on are already counted, anything newer than now reaches on_message
+		before_id = self.ledger.held_first or discord.utils.time_snowflake(datetime.datetime.now(datetime.timezone.utc))
+
+		rebuild = HistoricalRebuild(equal_channel, self.check_message, after_id, before_id,
+			self.historical_search_partitions, self.historical_search_concurrency, self.historical_search_workers, self.act_on_historical_message)
+
+		self.searching = True
+
+		try:
+			chaos_data = await rebuild.run() # Full totals or, for an incremental search, deltas
+		finally:
+			self.searching = False # On failure the ledger stays held and the search is retried from the same checkpoint
+
+		newest_id = before_id - 1 # Everything up to the bound has been counted, even if the range was empty
+
+		if full:
+			print(f"\tSaving new chaos data for guild {self.guild_id}")
+			await self.ledger.replace(chaos_data, newest_id)
+		else:
+			print(f"\tApplying chaos changes from {chaos_data.__len__()} user{'' if chaos_data.__len__() == 1 else 's'} in guild {self.guild_id}")
+			await self.ledger.merge(chaos_data, newest_id)
+
+	async def act_on_historical_message(self, message: discord.Message, check: int):
+		if check == 1:
+			self.clear_reactions(message)
+
+		elif check == -1:
+			self.purge_historical_message(message)
+
+	def purge_historical_message(self, message: discord.Message):
+		if self.historical_purge:
+			print("\t\tPurging message by ", message.author.name, " (", message.author.id, ") saying ", message.clean_content, sep = "")
+			self.outbound.delete(message) # Batched into bulk deletes
+		else:
+			print("\t\tNot purging bad message at", message.jump_url)
+
+	def check_message(self, message: discord.Message) -> int: # 1 good, -1 bad, 0 not ours to judge
+		if message.author.id == self.client.user.id: # Don't listen to myself by mistake
+			return 0
+
+		if message.channel is not None:
+			if message.channel.id != self.equal_channel_id: # Equal text channel
+				return 0
+
+			day = message.created_at
+			return self.rules.classify(message.clean_content, features_of(message), day.month, day.day, self.birthdays.on(day.month, day.day))
+
+		return 0
+
+	def clear_reactions(self, message: discord.Message):
+		if self.rules.clear_reactions and message.reactions.__len__(): # Don't allow reactions
+			self.outbound.submit(("reactions", message.channel.id), PRIORITY_MEMBER, message.clear_reactions) # Auto fix
+
+	def assign_equal_role(self, member: discord.member.Member):
+		equal_role = discord.utils.get(member.guild.roles, id = self.equal_role_id) # Get Equal role
+
+		if equal_role is None:
+			print(f"Unable to assign Equal role as a role couldn't be found with id \"{self.equal_role_id}\"")
+		else:
+			self.outbound.submit(("member", member.guild.id), PRIORITY_MEMBER,
+				lambda: member.edit(nick = "Equal", roles = [equal_role], reason = "To make us all Equal")) # Set nickname and roles
+
+	async def close(self): # The leaderboard is closed first by the client, while the outbound scheduler is still running
+		if self.retry_task is not None:
+			self.retry_task.cancel()
+
+		await self.ledger.close() # Write out anything still pending before disconnecting
+		await self.birthdays.close()
+		self.storage.close()
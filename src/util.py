@@ -0,0 +1,60 @@
+from typing import Callable, TextIO
+from pathlib import Path
+from metrics import metrics
+import tempfile
+import json
+import os
+
+def _read_json(path: str) -> dict:
+	with open(path, "r") as json_file:
+		if metrics.enabled:
+			metrics.inc("json_reads_total", file = os.path.basename(path))
+			metrics.inc("json_read_bytes_total", os.fstat(json_file.fileno()).st_size, file = os.path.basename(path))
+
+		return json.load(json_file)
+
+def _write_json(path: str, data: dict, neat: bool = False):
+	with open(path, "w") as json_file:
+		if neat:
+			json.dump(data, json_file, indent = 4)
+		else:
+			json.dump(data, json_file)
+
+		if metrics.enabled:
+			metrics.inc("json_writes_total", file = os.path.basename(path))
+			metrics.inc("json_write_bytes_total", json_file.tell(), file = os.path.basename(path))
+
+_project_root = Path(os.path.abspath(__file__)).parent.parent.__str__()
+
+POST_COST = 50 # Chaos points taken for each chaos post
+
+def _write_json_atomic(path: str, data: dict):
+	_write_atomic(path, lambda json_file: json.dump(data, json_file))
+
+def _write_atomic(path: str, write: Callable[[TextIO], None]): # Write to a temp file, fsync, then rename over so a crash never leaves half a file
+	descriptor, temp_path = tempfile.mkstemp(prefix = f"{os.path.basename(path)}.", suffix = ".tmp", dir = os.path.dirname(path) or ".") # Unique so writers never share one
+
+	try:
+		with os.fdopen(descriptor, "w") as json_file:
+			write(json_file)
+			json_file.flush()
+			os.fsync(json_file.fileno())
+
+			if metrics.enabled:
+				metrics.inc("json_writes_total", file = os.path.basename(path))
+				metrics.inc("json_write_bytes_total", json_file.tell(), file = os.path.basename(path))
+	except BaseException:
+		os.unlink(temp_path)
+		raise
+
+	os.replace(temp_path, path)
+
+	try:
+		directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+	except OSError: # Not every platform lets you open a directory
+		return
+
+	try:
+		os.fsync(directory)
+	finally:
+		os.close(directory)